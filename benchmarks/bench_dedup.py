@@ -0,0 +1,92 @@
+"""previous_dataのJSON辞書とBloomフィルターの読み込み時間・メモリ使用量を比べる
+
+python benchmarks/bench_dedup.py [件数 ...]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from jmty_snipe.fingerprint import BloomFilter, article_id  # noqa: E402
+
+PROBES = 1000
+
+
+def make_url(index):
+    return f"https://jmty.jp/tokyo/sale-fur/article-{index:x}"
+
+
+def make_item(index):
+    return {
+        "タイトル": f"昇降式デスク　flexispot　{index}",
+        "価格": "4,000円",
+        "出品日": "1月2日",
+        "取引場所": "東京都",
+        "お気に入り数": "",
+        "商品URL": make_url(index),
+    }
+
+
+def build_files(directory, count):
+    """count件分のJSONとBloomフィルターのファイルを作る"""
+    json_file = os.path.join(directory, f"previous_data_{count}.json")
+    bloom_file = os.path.join(directory, f"seen_{count}.bloom")
+    with open(json_file, "w") as file:
+        json.dump({make_url(i): make_item(i) for i in range(count)}, file, ensure_ascii=False)
+    bloom = BloomFilter(bloom_file, capacity=count)
+    for i in range(count):
+        bloom.add(article_id(make_url(i)))
+    bloom.close()
+    return json_file, bloom_file
+
+
+def measure(kind, filename, count):
+    """子プロセスで読み込みと所属判定を行い、時間と最大RSSの増分を返す"""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if kind == "json":
+        with open(filename, "r") as file:
+            seen = json.load(file)
+        contains = seen.__contains__
+    else:
+        seen = BloomFilter(filename)
+        contains = lambda url: article_id(url) in seen  # noqa: E731
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(PROBES):
+        contains(make_url(count + i if i % 2 else i))
+    lookup_us = (time.perf_counter() - start) / PROBES * 1e6
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    print(json.dumps({"load_seconds": load_seconds, "lookup_us": lookup_us, "rss_kb": rss_kb}))
+
+
+def main(counts):
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'件数':>9} {'形式':>6} {'ファイル':>10} {'読み込み':>10} {'判定':>8} {'RSS増分':>10}")
+        for count in counts:
+            files = dict(zip(("json", "bloom"), build_files(directory, count)))
+            for kind, filename in files.items():
+                output = subprocess.run(
+                    [sys.executable, __file__, "--measure", kind, filename, str(count)],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                result = json.loads(output)
+                size_kb = os.path.getsize(filename) / 1024
+                print(
+                    f"{count:>10} {kind:>6} {size_kb:>10.0f}KB {result['load_seconds'] * 1000:>10.2f}ms"
+                    f" {result['lookup_us']:>7.1f}us {result['rss_kb']:>10}KB"
+                )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,71 @@
+"""エントリーポイントのimport時間(コールドスタート)を測る
+
+python benchmarks/bench_import.py [--repeat N] [--output 結果.json]
+
+毎回新しいPythonプロセスでimportし、所要時間と読み込まれた重い依存を表示する。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# (名前, sys.pathに追加するディレクトリ, importするモジュール)
+TARGETS = [
+    ("core", ROOT, "jmty_snipe.app"),
+    ("daemon", ROOT, "scraping"),
+    ("gcp", os.path.join(ROOT, "serverless", "gcp"), "main"),
+    ("aws", os.path.join(ROOT, "serverless", "aws"), "handler"),
+]
+HEAVY_MODULES = ("bs4", "lxml", "requests", "google.cloud.storage", "boto3", "gspread", "pandas", "yaml", "schedule")
+
+PROBE = """
+import json, sys, time
+sys.path[:0] = [{path!r}, {root!r}]
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(path, module, repeat):
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        code = PROBE.format(path=path, root=ROOT, module=module, heavy=HEAVY_MODULES)
+        # 相対パスの設定ファイルを読むエントリーポイントがあるため、リポジトリ直下で実行する
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.splitlines()[-1]
+        result = json.loads(output)
+        timings.append(result["seconds"])
+        loaded = result["loaded"]
+    return {"median": statistics.median(timings), "min": min(timings), "runs": repeat, "loaded": loaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = {}
+    for name, path, module in TARGETS:
+        try:
+            results[f"import/{name}"] = measure(path, module, args.repeat)
+        except subprocess.CalledProcessError as e:
+            print(f"{name}: importに失敗しました\n{e.stderr.strip().splitlines()[-1]}")
+            continue
+        result = results[f"import/{name}"]
+        print(f"{name:8} {result['median'] * 1000:8.1f}ms (最小 {result['min'] * 1000:.1f}ms) 読み込み: {', '.join(result['loaded'])}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"python": sys.version.split()[0], "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""一覧ページの解析をプロセスのワーカーに分けたときのスループットを測る
+
+python benchmarks/bench_parse_pool.py [--pages N] [--parser html.parser|lxml] [--workers 1,2,4] [--output 結果.json]
+
+fixtures/の一覧ページをN件並べたコーパスを、同じプロセス内とParserPoolのワーカー数ごとに解析し、
+1秒あたりのページ数を表示する。ワーカーは計測前に起動しておき、起動の時間は含めない。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from jmty_snipe.listing import to_listings  # noqa: E402
+from jmty_snipe.parsepool import ParserPool  # noqa: E402
+from jmty_snipe.parsers import get_parser  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, "fixtures")
+PAGES = ("small", "typical", "large")
+
+
+def load_corpus(count):
+    pages = []
+    for name in PAGES:
+        with open(os.path.join(FIXTURES, f"{name}.html"), "rb") as file:
+            pages.append(file.read())
+    return [pages[index % len(pages)] for index in range(count)]
+
+
+def measure(parse_many, corpus):
+    start = time.perf_counter()
+    parsed = parse_many(corpus)
+    seconds = time.perf_counter() - start
+    return parsed, {"seconds": seconds, "pages_per_second": len(corpus) / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--parser", default="html.parser")
+    parser.add_argument("--workers", help="カンマ区切りのワーカー数(既定は1からCPU数まで倍々)")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.pages)
+    cpus = os.cpu_count() or 1
+    if args.workers:
+        counts = [int(count) for count in args.workers.split(",")]
+    else:
+        counts = sorted({1, cpus} | {2**power for power in range(cpus.bit_length()) if 2**power <= cpus})
+    parse = get_parser(args.parser)
+    # ワーカーと同じく、価格などを解析したListingにするところまで測る
+    expected, baseline = measure(lambda pages: [to_listings(parse(page)) for page in pages], corpus)
+    results = {"parse_pool/in_process": baseline}
+    print(f"CPU {cpus}個 / {args.pages}ページ / {args.parser}")
+    print(f"{'同じプロセス':12} {baseline['pages_per_second']:8.1f}ページ/秒")
+    for count in counts:
+        pool = ParserPool(args.parser, max_workers=count, chunksize=4)
+        started, startup = pool.warm_up()
+        parsed, result = measure(pool.parse_many, corpus)
+        pool.close()
+        if parsed != expected:
+            print(f"ワーカー{count}個: 解析結果が同じプロセスでの解析と一致しません")
+            sys.exit(1)
+        result["startup_seconds"] = startup
+        results[f"parse_pool/{count}_workers"] = result
+        speedup = result["pages_per_second"] / baseline["pages_per_second"]
+        print(
+            f"{f'ワーカー{count}個':12} {result['pages_per_second']:8.1f}ページ/秒 (x{speedup:.2f}, "
+            f"起動 {startup * 1000:.0f}ms, {started}プロセス)"
+        )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"python": sys.version.split()[0], "cpus": cpus, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
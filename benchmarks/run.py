@@ -0,0 +1,186 @@
+"""保存した一覧ページを使ったオフラインのベンチマーク
+
+python benchmarks/run.py [--repeat N] [--output 結果.json] [--compare 以前の結果.json]
+
+fixtures/のHTMLをローカルのFixtureServerから返し、取得・解析・重複判定・
+複数検索の1ティックを計測する。結果はコミットごとに比べられるようJSONで保存する。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from jmty_snipe import scraper  # noqa: E402
+from jmty_snipe.engine import run_searches  # noqa: E402
+from jmty_snipe.fakeserver import FixtureServer  # noqa: E402
+from jmty_snipe.fetcher import Fetcher  # noqa: E402
+from jmty_snipe.fingerprint import FingerprintState  # noqa: E402
+from jmty_snipe.parsers import parse_items_bs4, parse_items_lxml  # noqa: E402
+from jmty_snipe.scraper import fetch_data, parse_page, scrape_items  # noqa: E402
+from jmty_snipe.store import SeenStore  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, "fixtures")
+PAGES = ("small", "typical", "large")
+STORE_SIZES = (1_000, 10_000, 100_000)
+TICK_SEARCHES = (10, 50)
+
+
+def measure(function, repeat):
+    """functionをrepeat回実行し、所要時間の統計を返す"""
+    function()  # 1回目はキャッシュなどの影響があるため捨てる
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "median": statistics.median(timings),
+        "min": timings[0],
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "runs": repeat,
+    }
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, f"{name}.html"), "rb") as file:
+        return file.read()
+
+
+def bench_fetch(server, repeat):
+    results = {}
+    fetcher = Fetcher()
+    for name in PAGES:
+        url = f"{server.url}/{name}"
+        # どちらも取得と解析までを測り、接続を使い回すかどうかだけを比べる
+        results[f"fetch_data/pooled/{name}"] = measure(lambda: fetch_data(url, fetcher), repeat)
+        results[f"fetch_data/urlopen/{name}"] = measure(lambda: fetch_data(url), repeat)
+    fetcher.close()
+    return results
+
+
+def bench_parse(repeat):
+    results = {}
+    for name in PAGES:
+        content = read_fixture(name)
+        results[f"scrape_items/{name}"] = measure(lambda: scrape_items(parse_page(content)), repeat)
+        results[f"parse/html.parser/{name}"] = measure(lambda: parse_items_bs4(content), repeat)
+        results[f"parse/lxml/{name}"] = measure(lambda: parse_items_lxml(content), repeat)
+    return results
+
+
+def bench_dedup(directory, repeat):
+    """既知の商品がsize件ある状態で、最大ページ分の商品を重複判定する"""
+    urls = [item["商品URL"] for item in parse_items_bs4(read_fixture("large"))]
+    results = {}
+    for size in STORE_SIZES:
+        known = {f"https://jmty.jp/tokyo/sale-fur/article-{index:x}": {"商品URL": index} for index in range(size)}
+        sqlite_store = SeenStore(os.path.join(directory, f"seen_{size}.db"))
+        bloom_store = FingerprintState(os.path.join(directory, f"seen_{size}.bloom"), capacity=max(size, 100_000))
+        for url, item in known.items():
+            sqlite_store[url] = item
+            bloom_store[url] = item
+        sqlite_store.commit()
+        bloom_store.commit()
+        for kind, store in (("json", known), ("sqlite", sqlite_store), ("bloom", bloom_store)):
+            results[f"dedup/{kind}/{size}"] = measure(lambda: [url for url in urls if url not in store], repeat)
+    return results
+
+
+def bench_tick(server, directory, repeat):
+    """searches件の検索を1ティック実行する(初回と、変化のない2回目以降)"""
+    results = {}
+    for count in TICK_SEARCHES:
+        searches = [
+            {
+                "name": f"search{index}",
+                "location": "all",
+                "category": "fur",
+                "keyword": f"kw{index}",
+                "state": os.path.join(directory, f"tick_{count}.json"),
+                "max_pages": 1,
+            }
+            for index in range(count)
+        ]
+
+        def tick():
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_searches(searches, lambda search, items: None, fetcher=fetcher, parse_items=parse_items_lxml)
+
+        fetcher = Fetcher(max_workers=16, per_host=16)
+        start = time.perf_counter()
+        tick()
+        results[f"tick/{count}_searches/first"] = {"median": time.perf_counter() - start, "runs": 1}
+        results[f"tick/{count}_searches/steady"] = measure(tick, repeat)
+        fetcher.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(results, previous_file):
+    """以前の結果と中央値を比べて表示する"""
+    with open(previous_file, "r") as file:
+        previous = json.load(file)["results"]
+    for name, result in results.items():
+        if name in previous:
+            ratio = result["median"] / previous[name]["median"]
+            mark = " <-- 遅くなりました" if ratio > 1.2 else ""
+            print(f"{name:45} {previous[name]['median'] * 1000:10.3f}ms -> {result['median'] * 1000:10.3f}ms ({ratio:.2f}x){mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, FixtureServer(FIXTURES) as server:
+        # 一覧ページのURLはどれもtypical.htmlを返す
+        os.symlink(os.path.join(FIXTURES, "typical.html"), os.path.join(directory, "default.html"))
+        for name in PAGES:
+            os.symlink(os.path.join(FIXTURES, f"{name}.html"), os.path.join(directory, f"{name}.html"))
+        server.directory = directory
+        scraper.BASE_URL = server.url
+        results.update(bench_fetch(server, args.repeat))
+        results.update(bench_parse(args.repeat))
+        results.update(bench_dedup(directory, args.repeat))
+        results.update(bench_tick(server, directory, max(3, args.repeat // 4)))
+
+    for name, result in results.items():
+        print(f"{name:45} {result['median'] * 1000:10.3f}ms")
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(
+            {"commit": commit, "python": platform.python_version(), "time": time.time(), "results": results},
+            file,
+            indent=2,
+        )
+    print(f"結果を{output}に保存しました")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
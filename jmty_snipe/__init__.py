@@ -0,0 +1 @@
+"""ジモティー監視の共通モジュール"""
@@ -0,0 +1,182 @@
+import functools
+import os
+
+from .engine import create_fetcher, create_parser, discard_pages, forget, load_config, run_searches, state_lock
+from .metrics import metrics
+from .notify import create_dispatcher
+from .store import load_state, save_state
+
+
+class App:
+    """設定ファイルから取得・解析・通知の各ステージを組み立て、エントリーポイント間で共有する
+
+    常駐のデーモン、GCPの関数、AWS Lambdaのハンドラーはこのクラスを作って呼ぶだけにする。
+    スプレッドシート・詳細の取得・価格の履歴・アーカイブは設定がある場合のみ、使うときに読み込む。
+    """
+
+    def __init__(self, config_file, json_logs=False, sheet_credentials=None):
+        self.config = load_config(config_file)
+        self.searches = self.config["searches"]
+        # 全ての検索でコネクションプールと解析関数を共有する
+        self.fetcher = create_fetcher(self.config)
+        self.parse_items = create_parser(self.config)
+        # 通知はバックグラウンドで送り、スクレイピングを待たせない
+        self.notifications = create_dispatcher(self.config)
+        self.enricher = None
+        if self.config.get("enrich"):
+            from .enrich import create_enricher
+
+            # 新着の記事ページを取得して詳細を追って通知する
+            self.enricher = create_enricher(self.config, self.fetcher, self.notify_details)
+        self.history = None
+        if self.config.get("history"):
+            from .history import HistoryStore
+
+            # 一覧で見た商品の価格の推移を記録し、値下げと再出品を知らせる
+            self.history = HistoryStore(self.config["history"])
+        self.archive = None
+        if self.config.get("archive"):
+            from .archive import create_archive
+
+            # 一覧で見た全ての商品を列ごとに保存し、相場より安い新着に印を付ける
+            self.archive = create_archive(self.config)
+        self.coordinator = None
+        if self.config.get("shard"):
+            from .coordinator import create_coordinator
+
+            # 複数のワーカーで検索を分担する
+            self.coordinator = create_coordinator(self.config)
+        self.sheet_credentials = sheet_credentials
+        self.sheet = None
+        # ステージごとの所要時間をJSONログで確認できるようにする。/metricsはwatch()でのみ起動し、
+        # 計測用のスクリプトや同じプロセスの別のAppが常駐のデーモンとポートを取り合わないようにする
+        self.metrics_options = dict(self.config.get("metrics", {}))
+        self.metrics_server = None
+        metrics.configure(**{"json_logs": json_logs, **self.metrics_options, "port": None})
+
+    def get_sheet(self):
+        """スプレッドシートの出力先を初回のみ開く。SPREADSHEET_KEYがなければ使わない"""
+        if self.sheet is None and self.sheet_credentials and os.environ.get("SPREADSHEET_KEY"):
+            from .sheets import SheetSink, open_worksheet
+
+            worksheet = open_worksheet(self.sheet_credentials, os.environ.get("SPREADSHEET_KEY"))
+            self.sheet = SheetSink(worksheet)
+        return self.sheet
+
+    def notify_new_items(self, search, new_items):
+        """新着商品を通知先とスプレッドシートに送る"""
+        if self.archive is not None:
+            new_items = self.archive.score(search, new_items)
+        # 通知を先に積み、詳細の取得やスプレッドシートの書き込みを待たせない
+        self.notifications.put(search, new_items)
+        if self.enricher is not None:
+            self.enricher.submit(search, new_items)
+        if self.get_sheet() is not None:
+            with metrics.timer("jmty_stage_seconds", stage="sheet", search=search["name"]):
+                self.sheet.write(new_items)
+
+    def notify_details(self, search, items):
+        """記事ページの詳細を付けた商品を追って送る"""
+        self.notifications.put(search, items, heading="詳細")
+
+    def notify_price_drops(self, search, items):
+        """値下げした既知の商品を通知先に送る"""
+        self.notifications.put(search, items, heading="値下げ情報")
+
+    def undelivered(self, filenames, flush_timeout=None):
+        """送れなかった新着の商品URLを状態ファイルごとに返す
+
+        flush_timeoutを指定すると送り終えるまで待ち、それでも送れなかった通知は諦めて返す。
+        """
+        if flush_timeout is not None and not self.notifications.flush(flush_timeout):
+            self.notifications.abandon()
+        return self.notifications.take_undelivered(filenames)
+
+    def run(self, searches=None, load_state=load_state, save_state=save_state, flush_timeout=None):
+        """検索を1回ずつ実行し、検索ごとの結果を返す
+
+        flush_timeoutを指定すると、状態を保存する前に通知を送り終えるまで待ち、送れなかった商品は
+        保存しない。実行が終わると止まるサーバーレスの関数で、通知を取りこぼさないために使う。
+        """
+        return run_searches(
+            self.searches if searches is None else searches,
+            self.notify_new_items,
+            load_state=load_state,
+            save_state=save_state,
+            fetcher=self.fetcher,
+            parse_items=self.parse_items,
+            early_exit=self.config.get("early_exit", 0),
+            merge_keywords=self.config.get("merge_keywords", False),
+            history=self.history,
+            on_price_drops=self.notify_price_drops,
+            archive=self.archive,
+            undelivered=functools.partial(self.undelivered, flush_timeout=flush_timeout),
+        )
+
+    def flush(self, timeout=None):
+        """詳細の取得と通知を送り終えるまで待つ"""
+        if self.enricher is not None:
+            self.enricher.flush(timeout)
+        return self.notifications.flush(timeout)
+
+    def run_shard(self, searches):
+        """このワーカーが担当する検索のみ実行する。担当でなければNoneを返す"""
+        from .coordinator import shard_name
+
+        if self.coordinator is not None and not self.coordinator.owns(shard_name(searches)):
+            return None
+        return self.run(searches)
+
+    def watch(self):
+        """検索ごとの間隔で監視し、Ctrl+C/SIGTERMで実行中のティックと通知を終えてから止める
+
+        状態ファイルを共有する検索は同じティックで実行し、新着を該当する全ての検索に届ける。
+        "shard"を設定した場合、全てのワーカーが全ての検索を監視し、担当の検索のみ実行する。
+        検索を分担する場合は取得をまとめられる検索ごとに分け、共有のseen_indexで先に取ったワーカーのみが通知する。
+        """
+        import asyncio
+
+        from .planner import group_searches
+        from .watcher import Watcher
+
+        # 取得をまとめられる検索と、状態ファイルを共有する検索は同じティックで実行する
+        groups = group_searches(
+            self.searches, self.config.get("merge_keywords", False), by_state=not self.config.get("shard")
+        )
+        self.metrics_server = metrics.configure(**{"json_logs": metrics.json_logs, **self.metrics_options})
+        watcher = Watcher(self.searches, self.run_shard, groups=groups, **self.config.get("watch", {}))
+        asyncio.run(watcher.run())
+        self.close(timeout=30)
+
+    def close(self, timeout=None):
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        if self.coordinator is not None:
+            self.coordinator.close()
+        if self.enricher is not None:
+            self.enricher.close(timeout)
+        self.notifications.close(timeout)
+        # 止める前に送れなかった通知は、次に起動したときに新着として通知し直す
+        forgotten = set()
+        for filename, urls in self.notifications.take_undelivered().items():
+            try:
+                with state_lock(filename):
+                    data = load_state(filename)
+                    forget(data, urls)
+                    save_state(filename, data)
+                forgotten.add(filename)
+            except Exception as e:
+                print(f"通知できなかった商品を戻せませんでした({filename}): {e}")
+        if forgotten and self.fetcher.cache is not None:
+            from .planner import plan
+
+            discard_pages(self.fetcher, plan(self.searches, self.config.get("merge_keywords", False)), forgotten)
+            try:
+                self.fetcher.cache.save()
+            except Exception as e:
+                print(f"HTTPキャッシュの保存中にエラーが発生しました: {e}")
+        # 解析のワーカーを起動している場合は止める
+        if hasattr(self.parse_items, "close"):
+            self.parse_items.close()
+        self.fetcher.close()
@@ -0,0 +1,418 @@
+import array
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from .listing import parse_price
+from .metrics import metrics
+from .rules import normalize
+
+# 数値の列のarray.arrayの型コード。価格が不明な行は-1にする
+NUMERIC_COLUMNS = {"seen_at": "d", "price": "q", "favorites": "q"}
+TEXT_COLUMNS = ("url", "title", "region")
+# 地域ごとの件数がこれより少なければ、相場は全地域の値を使う
+MIN_SAMPLES = 5
+# これより長く見ていない記事は、取り下げられた(または売れた)とみなす
+GONE_AFTER = 2 * 86400
+UNSAFE = re.compile(r"[^\w.-]+")
+
+
+def load_numpy():
+    """numpyがあれば返す。なければNoneを返す"""
+    try:
+        import numpy  # 集計を速くする場合のみ必要
+    except ImportError:
+        return None
+    return numpy
+
+
+def market_key(search):
+    """相場をまとめる単位(カテゴリー・ジャンル・キーワード)を検索から作る"""
+    return "/".join([search.get("category", ""), search.get("genre", ""), normalize(search.get("keyword", ""))])
+
+
+def region_of(item):
+    """取引場所の都道府県を返す。不明なら空文字列"""
+    location = normalize(item["取引場所"]).split()
+    return location[0] if location and location[0] != "不明" else ""
+
+
+def quantiles(values, points):
+    """値のパーセンタイル(線形補間)をpointsの順に返す"""
+    ordered = sorted(values)
+    result = []
+    for point in points:
+        position = (len(ordered) - 1) * point / 100
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        result.append(ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower))
+    return result
+
+
+def grouped_quantiles(numpy, keys, values, points):
+    """キーごとの値のパーセンタイルを、キーでまとめて並べ替えて一度に求める
+
+    (キー, 件数, [パーセンタイルごとの配列])を返す。補間はquantiles()と同じ。
+    """
+    order = numpy.lexsort((values, keys))
+    keys = keys[order]
+    values = values[order].astype("f8")
+    groups, starts, counts = numpy.unique(keys, return_index=True, return_counts=True)
+    result = []
+    for point in points:
+        position = (counts - 1) * point / 100
+        lower = numpy.floor(position).astype("i8")
+        upper = numpy.minimum(lower + 1, counts - 1)
+        low = values[starts + lower]
+        result.append(low + (values[starts + upper] - low) * (position - lower))
+    return groups, counts, result
+
+
+def aggregate_rows(partitions, now):
+    """パーティションの行を記事ごとにまとめ、({(相場の単位, 都道府県): 四分位}, {相場の単位: 掲載日数})を返す
+
+    numpyがない場合の集計。aggregate_arrays()と同じ結果になる。
+    """
+    # 記事ごとに(都道府県, 最新の価格, 最初に見た時刻, 最後に見た時刻)にまとめる
+    articles = {}
+    for market, columns in partitions:
+        for seen_at, price, url, region in zip(columns["seen_at"], columns["price"], columns["url"], columns["region"]):
+            key = (market, url)
+            previous = articles.get(key)
+            if previous is None:
+                articles[key] = [region, price, seen_at, seen_at]
+            elif seen_at >= previous[3]:
+                previous[1] = price
+                previous[3] = seen_at
+            else:
+                previous[2] = min(previous[2], seen_at)
+    groups = {}
+    lifetimes = {}
+    for (market, _), (region, price, first_seen, last_seen) in articles.items():
+        if price >= 0:
+            # 都道府県が不明な記事は全地域の相場にのみ含める
+            if region:
+                groups.setdefault((market, region), []).append(price)
+            groups.setdefault((market, ""), []).append(price)
+        if now - last_seen > GONE_AFTER:
+            lifetimes.setdefault(market, []).append((last_seen - first_seen) / 86400)
+    prices = {}
+    for key, values in groups.items():
+        low, median, high = quantiles(values, (25, 50, 75))
+        prices[key] = (len(values), low, median, high)
+    durations = {market: (len(values), quantiles(values, (50,))[0]) for market, values in lifetimes.items()}
+    return prices, durations
+
+
+def aggregate_arrays(numpy, partitions, now):
+    """aggregate_rows()と同じ集計を、numpyで列ごとにまとめて行う
+
+    全てのパーティションの列をつなげ、(相場の単位, URL, 時刻)で並べ替えて記事の境目を求める。
+    行ごとのPythonの処理は、URLと都道府県を整数にするところだけにする。
+    """
+    market_names = {}
+    region_names = {}
+    seen_at, prices, url_keys, market_codes, region_codes = [], [], [], [], []
+    for market, columns in partitions:
+        rows = len(columns["url"])
+        market_codes.append(numpy.full(rows, market_names.setdefault(market, len(market_names)), dtype="i8"))
+        seen_at.append(numpy.frombuffer(columns["seen_at"], dtype="f8"))
+        prices.append(numpy.frombuffer(columns["price"], dtype="i8"))
+        # URLは同じ集計の中で比べられればよいため、文字列のハッシュで記事を見分ける
+        url_keys.append(numpy.fromiter(map(hash, columns["url"]), dtype="i8", count=rows))
+        for region in set(columns["region"]):
+            region_names.setdefault(region, len(region_names))
+        region_codes.append(numpy.fromiter(map(region_names.__getitem__, columns["region"]), dtype="i8", count=rows))
+    if not market_names:
+        return {}, {}
+    seen_at, prices, url_keys, market_codes, region_codes = (
+        numpy.concatenate(column) for column in (seen_at, prices, url_keys, market_codes, region_codes)
+    )
+    order = numpy.lexsort((seen_at, url_keys, market_codes))
+    seen_at, prices, url_keys, market_codes, region_codes = (
+        column[order] for column in (seen_at, prices, url_keys, market_codes, region_codes)
+    )
+    # 記事(相場の単位とURLの組)の最初と最後の行。最初の行が最初に見た時刻、最後の行が最新の価格
+    starts = numpy.ones(len(order), dtype=bool)
+    starts[1:] = (url_keys[1:] != url_keys[:-1]) | (market_codes[1:] != market_codes[:-1])
+    first = numpy.flatnonzero(starts)
+    last = numpy.append(first[1:] - 1, len(order) - 1)
+    article_markets = market_codes[first]
+    article_regions = region_codes[first]
+    latest_prices = prices[last]
+    first_seen = seen_at[first]
+    last_seen = seen_at[last]
+
+    # 都道府県ごとと全地域の相場を一度に求める。全地域は都道府県の番号を-1にする
+    priced = latest_prices >= 0
+    unknown = region_names.get("", -1)
+    regional = priced & (article_regions != unknown)
+    keys = numpy.concatenate([article_markets[regional], article_markets[priced]]) * (len(region_names) + 1)
+    keys += numpy.concatenate([article_regions[regional], numpy.full(int(priced.sum()), -1, dtype="i8")]) + 1
+    values = numpy.concatenate([latest_prices[regional], latest_prices[priced]])
+    markets = {code: market for market, code in market_names.items()}
+    regions = {code + 1: region for region, code in region_names.items()}
+    regions[0] = ""
+    price_stats = {}
+    if len(keys):
+        groups, counts, (low, median, high) = grouped_quantiles(numpy, keys, values, (25, 50, 75))
+        for key, count, *stats in zip(groups.tolist(), counts.tolist(), low.tolist(), median.tolist(), high.tolist()):
+            market, region = divmod(key, len(region_names) + 1)
+            price_stats[(markets[market], regions[region])] = (count, *stats)
+
+    gone = now - last_seen > GONE_AFTER
+    durations = {}
+    if gone.any():
+        days = (last_seen[gone] - first_seen[gone]) / 86400
+        groups, counts, (median,) = grouped_quantiles(numpy, article_markets[gone], days, (50,))
+        for market, count, days in zip(groups.tolist(), counts.tolist(), median.tolist()):
+            durations[markets[market]] = (count, days)
+    return price_stats, durations
+
+
+class MarketIndex:
+    """集計済みの相場。通知のたびに履歴を読まず、辞書を引くだけで相場との差を出す"""
+
+    def __init__(self, prices, durations, built_at):
+        # {(相場の単位, 都道府県): (件数, 25パーセンタイル, 中央値, 75パーセンタイル)}。都道府県""は全地域
+        self.prices = prices
+        # {相場の単位: (件数, 掲載日数の中央値)}
+        self.durations = durations
+        self.built_at = built_at
+
+    def lookup(self, market, region):
+        """地域の件数が少なければ全地域の相場を返す"""
+        stats = self.prices.get((market, region))
+        if stats is None or stats[0] < MIN_SAMPLES:
+            stats = self.prices.get((market, ""))
+        return stats if stats is not None and stats[0] >= MIN_SAMPLES else None
+
+    def discount(self, market, region, price):
+        """相場の中央値より何%安いかを返す(高ければ負)。相場がなければNone"""
+        stats = self.lookup(market, region)
+        if stats is None or price is None or not stats[2]:
+            return None
+        return (stats[2] - price) / stats[2] * 100
+
+
+class ListingArchive:
+    """一覧で見た全ての商品を、検索と日付で分けた列ごとのファイルに追記するアーカイブ
+
+    <directory>/<検索名>/<日付>/に、数値の列はarray.tofileで固定長のバイナリ、文字列の列は1行1件で書く。
+    同じ日の同じ記事は価格が変わったときだけ追記するため、1日の行数は記事の数程度に収まる。
+    列ごとに追記するため、途中で止まって列の長さがずれた場合は、次の追記の前に短い列に合わせて切り詰める。
+    """
+
+    def __init__(self, directory, window_days=30, refresh=3600):
+        self.directory = directory
+        self.window_days = window_days
+        self.refresh = refresh
+        self.index = None
+        self._today = {}
+        self._lock = threading.Lock()
+        self._rebuilding = None
+
+    def _partition(self, search, day):
+        return os.path.join(self.directory, UNSAFE.sub("_", search["name"]), day)
+
+    def _today_prices(self, search, day):
+        """今日のパーティションに書いた記事ごとの最後の価格を返す"""
+        key = (search["name"], day)
+        if key not in self._today:
+            # 日付が変わったら前日分は忘れる
+            self._today = {name_day: rows for name_day, rows in self._today.items() if name_day[1] == day}
+            columns = read_partition(self._partition(search, day))
+            self._today[key] = dict(zip(columns["url"], columns["price"])) if columns else {}
+        return self._today[key]
+
+    def append(self, search, items, now=None):
+        """商品を今日のパーティションに追記し、追記した行数を返す"""
+        now = now or time.time()
+        day = datetime.date.fromtimestamp(now).isoformat()
+        with self._lock:
+            written = self._today_prices(search, day)
+            rows = []
+            for item in items:
+                price = parse_price(item["価格"])
+                price = -1 if price is None else price
+                if written.get(item["商品URL"]) == price:
+                    continue
+                written[item["商品URL"]] = price
+                favorites = parse_price(item.get("お気に入り数", "")) or 0
+                rows.append((now, price, favorites, item["商品URL"], item["タイトル"], region_of(item)))
+            if rows:
+                try:
+                    write_partition(self._partition(search, day), market_key(search), rows)
+                except OSError:
+                    # 書けなかった行は次の追記で切り詰められるため、今日の価格は読み直す
+                    self._today.pop((search["name"], day), None)
+                    raise
+        metrics.increment("jmty_archive_rows_total", len(rows), search=search["name"])
+        return len(rows)
+
+    def aggregate(self, now=None):
+        """直近window_days日のパーティションから相場を集計する。numpyがあれば列ごとにまとめて計算する"""
+        now = now or time.time()
+        since = datetime.date.fromtimestamp(now - self.window_days * 86400).isoformat()
+        numpy = load_numpy()
+        if numpy is not None:
+            prices, durations = aggregate_arrays(numpy, self.partitions(since), now)
+        else:
+            prices, durations = aggregate_rows(self.partitions(since), now)
+        return MarketIndex(prices, durations, now)
+
+    def partitions(self, since=""):
+        """日付がsince以降の(相場の単位, 列)を返す"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            search_dir = os.path.join(self.directory, name)
+            if not os.path.isdir(search_dir):
+                continue
+            for day in sorted(os.listdir(search_dir)):
+                if day < since:
+                    continue
+                path = os.path.join(search_dir, day)
+                columns = read_partition(path)
+                if columns:
+                    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                        yield json.load(f)["market"], columns
+
+    def _rebuild(self):
+        start = time.perf_counter()
+        try:
+            self.index = self.aggregate()
+        except Exception as e:
+            print(f"相場の集計中にエラーが発生しました: {e}")
+        finally:
+            metrics.observe("jmty_stage_seconds", time.perf_counter() - start, stage="aggregate")
+            with self._lock:
+                self._rebuilding = None
+
+    def market(self, now=None):
+        """最後に集計した相場を返す(まだなければNone)
+
+        refresh秒より古ければバックグラウンドのスレッドで集計し直し、通知を待たせない。
+        """
+        now = now or time.time()
+        with self._lock:
+            stale = self.index is None or now - self.index.built_at > self.refresh
+            if stale and self._rebuilding is None:
+                self._rebuilding = threading.Thread(target=self._rebuild, name="archive-aggregate", daemon=True)
+                self._rebuilding.start()
+        return self.index
+
+    def score(self, search, items):
+        """相場より安い商品に"相場"を付けたコピーを返す。集計がまだなければそのまま返す"""
+        index = self.market()
+        if index is None:
+            return list(items)
+        market = market_key(search)
+        scored = []
+        for item in items:
+            discount = index.discount(market, region_of(item), parse_price(item["価格"]))
+            if discount is not None and discount > 0:
+                median = index.lookup(market, region_of(item))[2]
+                item = {**item, "相場": f"中央値{median:,.0f}円より{discount:.0f}%安い"}
+            scored.append(item)
+        return scored
+
+
+def align_partition(path):
+    """途中で止まった書き込みで列の長さがずれていれば、全ての列を最も短い列の行数に切り詰め、行数を返す"""
+    sizes = {}
+    for name, typecode in NUMERIC_COLUMNS.items():
+        filename = os.path.join(path, f"{name}.bin")
+        itemsize = array.array(typecode).itemsize
+        sizes[filename] = (os.path.getsize(filename) if os.path.exists(filename) else 0, itemsize)
+    texts = {}
+    for name in TEXT_COLUMNS:
+        filename = os.path.join(path, f"{name}.txt")
+        if os.path.exists(filename):
+            with open(filename, "rb") as f:
+                texts[filename] = f.read()
+        else:
+            texts[filename] = b""
+    rows = min([size // itemsize for size, itemsize in sizes.values()] + [data.count(b"\n") for data in texts.values()])
+    ends = {filename: rows * itemsize for filename, (_, itemsize) in sizes.items()}
+    for filename, data in texts.items():
+        # rows行目の改行までを残す
+        ends[filename] = len(data) - len(data.split(b"\n", rows)[-1]) if rows else 0
+    for filename, end in ends.items():
+        if os.path.exists(filename) and os.path.getsize(filename) != end:
+            with open(filename, "r+b") as f:
+                f.truncate(end)
+    return rows
+
+
+def write_partition(path, market, rows):
+    """パーティションの各列に行を追記する。列の長さがずれていれば先に揃える"""
+    os.makedirs(path, exist_ok=True)
+    meta = os.path.join(path, "meta.json")
+    if not os.path.exists(meta):
+        with open(meta, "w", encoding="utf-8") as f:
+            json.dump({"market": market}, f, ensure_ascii=False)
+    align_partition(path)
+    columns = list(zip(*rows))
+    for (name, typecode), values in zip(NUMERIC_COLUMNS.items(), columns):
+        data = array.array(typecode, values)
+        # ファイルはリトルエンディアンで書く
+        if sys.byteorder == "big":
+            data.byteswap()
+        with open(os.path.join(path, f"{name}.bin"), "ab") as f:
+            data.tofile(f)
+    for name, values in zip(TEXT_COLUMNS, columns[len(NUMERIC_COLUMNS) :]):
+        with open(os.path.join(path, f"{name}.txt"), "a", encoding="utf-8") as f:
+            f.write("".join(" ".join(value.split()) + "\n" for value in values))
+
+
+def read_partition(path):
+    """パーティションの列を{列名: 値の並び}で返す。なければNoneを返す"""
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    columns = {}
+    for name, typecode in NUMERIC_COLUMNS.items():
+        filename = os.path.join(path, f"{name}.bin")
+        if not os.path.exists(filename):
+            return None
+        data = array.array(typecode)
+        with open(filename, "rb") as f:
+            content = f.read()
+        # 書きかけの値は読まない
+        data.frombytes(content[: len(content) - len(content) % data.itemsize])
+        if sys.byteorder == "big":
+            data.byteswap()
+        columns[name] = data
+    for name in TEXT_COLUMNS:
+        filename = os.path.join(path, f"{name}.txt")
+        if not os.path.exists(filename):
+            return None
+        with open(filename, "rb") as f:
+            content = f.read()
+        # 改行まで書けていない行は読まない
+        columns[name] = content[: content.rfind(b"\n") + 1].decode("utf-8").splitlines()
+    # 書き込みの途中で止まった行は読まない
+    rows = min(len(values) for values in columns.values())
+    return {name: values[:rows] for name, values in columns.items()}
+
+
+def create_archive(config):
+    """設定ファイルの"archive"項目からアーカイブを作る"""
+    options = dict(config["archive"])
+    archive = ListingArchive(options.pop("directory", "archive"), **options)
+    # 最初の新着までに相場を用意しておけるよう、起動時に集計を始める
+    archive.market()
+    return archive
+
+
+if __name__ == "__main__":
+    # python -m jmty_snipe.archive archive
+    index = ListingArchive(sys.argv[1], window_days=int(sys.argv[2]) if len(sys.argv) > 2 else 30).aggregate()
+    for (market, region), (count, low, median, high) in sorted(index.prices.items()):
+        print(f"{market} {region or '全地域'}: {count}件 中央値{median:,.0f}円 ({low:,.0f}〜{high:,.0f}円)")
+    for market, (count, days) in sorted(index.durations.items()):
+        print(f"{market}: 掲載日数の中央値{days:.1f}日 ({count}件)")
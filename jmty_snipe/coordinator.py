@@ -0,0 +1,178 @@
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from .store import is_sqlite
+
+
+class SqliteLeaseBackend:
+    """同じマシン(または共有ディスク)上のワーカー間で、リースをSQLiteのファイルロックで管理する
+
+    他のバックエンド(RedisやCloud Storageなど)も、同じメソッドを持てば差し替えられる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS workers (worker TEXT PRIMARY KEY, expires REAL NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (shard TEXT PRIMARY KEY, worker TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def _transaction(self, statements):
+        # BEGIN IMMEDIATEで書き込みロックを取り、確認と更新の間に他のワーカーが割り込まないようにする
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self.conn)
+                self.conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, worker, ttl):
+        """ワーカーが生きていることを記録し、生きているワーカーの一覧を返す"""
+        now = time.time()
+
+        def statements(conn):
+            conn.execute("INSERT OR REPLACE INTO workers (worker, expires) VALUES (?, ?)", (worker, now + ttl))
+            conn.execute("DELETE FROM workers WHERE expires < ?", (now,))
+            return [row[0] for row in conn.execute("SELECT worker FROM workers ORDER BY worker")]
+
+        return self._transaction(statements)
+
+    def acquire(self, shard, worker, ttl):
+        """リースが空いているか期限切れか自分のものなら取得(延長)し、Trueを返す"""
+        now = time.time()
+
+        def statements(conn):
+            row = conn.execute("SELECT worker, expires FROM leases WHERE shard = ?", (shard,)).fetchone()
+            if row is not None and row[0] != worker and row[1] >= now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (shard, worker, expires) VALUES (?, ?, ?)", (shard, worker, now + ttl)
+            )
+            return True
+
+        return self._transaction(statements)
+
+    def release(self, shard, worker):
+        self._transaction(
+            lambda conn: conn.execute("DELETE FROM leases WHERE shard = ? AND worker = ?", (shard, worker))
+        )
+
+    def leave(self, worker):
+        """ワーカーの登録と全てのリースを消し、残りのワーカーにすぐ引き継がせる"""
+
+        def statements(conn):
+            conn.execute("DELETE FROM leases WHERE worker = ?", (worker,))
+            conn.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+
+        self._transaction(statements)
+
+
+BACKENDS = {
+    "sqlite": SqliteLeaseBackend,
+}
+
+
+def rendezvous_owner(shard, workers):
+    """ワーカーの増減で動く担当をできるだけ少なくするため、HRWハッシュで担当を決める"""
+    return max(workers, key=lambda worker: hashlib.blake2b(f"{shard}|{worker}".encode(), digest_size=8).digest())
+
+
+class Coordinator:
+    """検索(のまとまり)をリースで複数のワーカーに分担させる
+
+    生きているワーカーの中からHRWハッシュで担当を決め、担当の検索のみリースを取って実行する。
+    ワーカーが止まるとハートビートとリースが期限切れになり、残りのワーカーに引き継がれる。
+    ハートビートとリースの延長はティックとは別のスレッドで行う。
+    """
+
+    def __init__(self, backend, worker=None, ttl=30):
+        self.backend = backend
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.ttl = ttl
+        self.workers = [self.worker]
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._run, name="coordinator", daemon=True)
+        self._thread.start()
+
+    def heartbeat(self):
+        workers = self.backend.heartbeat(self.worker, self.ttl)
+        with self._lock:
+            self.workers = workers = workers or [self.worker]
+            held = list(self.held)
+        for shard in held:
+            # 担当が他のワーカーに移った検索はリースを手放す
+            if rendezvous_owner(shard, workers) != self.worker:
+                self._release(shard)
+            elif not self.backend.acquire(shard, self.worker, self.ttl):
+                self._release(shard)
+
+    def _release(self, shard):
+        self.backend.release(shard, self.worker)
+        with self._lock:
+            self.held.discard(shard)
+
+    def _run(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"リースの更新中にエラーが発生しました: {e}")
+
+    def owns(self, shard):
+        """このワーカーが担当し、リースを取れた場合にTrueを返す"""
+        with self._lock:
+            workers = list(self.workers)
+        if rendezvous_owner(shard, workers) != self.worker:
+            return False
+        if not self.backend.acquire(shard, self.worker, self.ttl):
+            # 前の担当のリースが切れるまで待つ
+            return False
+        with self._lock:
+            self.held.add(shard)
+        return True
+
+    def close(self):
+        self._stop.set()
+        self.backend.leave(self.worker)
+
+
+def shard_name(searches):
+    return "+".join(search["name"] for search in searches)
+
+
+def check_states(searches):
+    """分担する検索の状態が、全てSQLiteの状態ファイルか確認する
+
+    ワーカー間で同じ商品を1回だけ通知できるのは、新着をclaim()で取れるSeenStoreを共有する場合のみ。
+    JSON・.bloom・Cloud Storageの状態では、別のワーカーが同じ商品を通知してしまう。
+    """
+    unshared = [search["name"] for search in searches if not is_sqlite(search["state"])]
+    if unshared:
+        raise ValueError(
+            '"shard"を使う場合は、全ての検索の状態をSQLiteにしてください(例: "seen_index": "seen.db"): '
+            + ", ".join(unshared)
+        )
+
+
+def create_coordinator(config):
+    """設定ファイルの"shard"項目から分担の調整役を作る。項目がなければNoneを返す"""
+    options = dict(config.get("shard") or {})
+    if not options:
+        return None
+    check_states(config["searches"])
+    backend = BACKENDS[options.pop("backend", "sqlite")](options.pop("path", "leases.db"))
+    return Coordinator(backend, **options)
@@ -0,0 +1,159 @@
+import functools
+import time
+
+from .listing import Listing
+from .parsepool import parse_pages
+from .parsers import iter_items_stream, scan_until_known
+from .scraper import build_url
+
+
+def scan_stream(chunks, is_known, stop_after, accept=None):
+    """ストリームで受け取った一覧ページを、既知の商品が続くところまで解析してListingのリストを返す"""
+    listings = (Listing.from_dict(item) for item in iter_items_stream(chunks))
+    return scan_until_known(listings, is_known, stop_after, accept)
+
+
+def subscriptions(fetch, states):
+    """取得をまとめた検索ごとの(状態, 絞り込み)のリストを返す"""
+    subscribers = fetch.get("subscribers", [fetch])
+    filters = fetch.get("filters", [None] * len(subscribers))
+    return [(states.get(search["state"], {}), accept) for search, accept in zip(subscribers, filters)]
+
+
+def known_checker(fetch, states):
+    """まとめた全ての検索で既知の商品(または該当しない商品)ならTrueを返す関数を作る"""
+    targets = subscriptions(fetch, states)
+    return lambda listing: all(
+        listing.url in previous_data or (accept is not None and not accept(listing))
+        for previous_data, accept in targets
+    )
+
+
+def page_priority(search, page_number):
+    """一覧ページを取得する優先度を返す。2ページ目以降は新着の確認より後に回す"""
+    if page_number > 1:
+        return "backfill"
+    return search.get("priority", "poll")
+
+
+def reached_known(listings, is_known, run, accept=None):
+    """既知の商品がrun件以上続いていればTrueを返す"""
+    known_run = 0
+    for listing in listings:
+        if accept is not None and not accept(listing):
+            continue
+        known_run = known_run + 1 if is_known(listing) else 0
+        if known_run >= run:
+            return True
+    return False
+
+
+def crawl(searches, fetcher, states, parse_items, early_exit=0):
+    """各取得(planner.planの結果)の一覧ページを、既知の商品に届くかmax_pagesに達するまで辿る
+
+    全ての取得の同じ深さのページはまとめて並列に取得する。初回(状態が空)の取得は
+    残りのページを一度に取得して埋め、2回目以降は既知の商品が見つかるまで1ページずつ進む。
+    解析した商品はListingにし、"accept"があれば直後に絞り込んで、どの検索にも該当しない商品は含めない。
+    取得ごとに{"items", "listings", "urls", "pages", "rejected", "fetch_seconds", "parse_seconds", "cached",
+    "error"}を返す。itemsは辞書の商品、listingsは同じ順のListing。
+    ストリームで解析する場合、解析の時間はfetch_secondsに含まれる。
+    """
+    checkers = [known_checker(search, states) for search in searches]
+    rules = [search.get("accept") for search in searches]
+    progress = [
+        {
+            "items": [],
+            "listings": [],
+            "urls": [],
+            "pages": 0,
+            "rejected": 0,
+            "fetch_seconds": 0.0,
+            "parse_seconds": 0.0,
+            "cached": False,
+            "error": None,
+            "seen": set(),
+        }
+        for _ in searches
+    ]
+    pending = [(index, 1) for index in range(len(searches))]
+    while pending:
+        urls = [build_url(searches[index], page) for index, page in pending]
+        consumers = None
+        if early_exit:
+            consumers = [
+                functools.partial(scan_stream, is_known=checkers[index], stop_after=early_exit, accept=rules[index])
+                for index, _ in pending
+            ]
+        priorities = [page_priority(searches[index], page) for index, page in pending]
+        round_seconds = {}
+        last_pages = {}
+        for index, page_number in pending:
+            last_pages[index] = max(last_pages.get(index, 0), page_number)
+        next_pending = []
+        done = set()
+        fetched = fetcher.fetch_all(urls, consumers, priorities)
+        parsed = {}
+        page_parse_seconds = 0.0
+        if not early_exit:
+            # 同じラウンドのページはまとめて解析し、ParserPoolなら複数のワーカーに分ける
+            positions = [
+                position for position, (page, _, error) in enumerate(fetched) if page is not None and error is None
+            ]
+            parse_start = time.perf_counter()
+            parsed = dict(zip(positions, parse_pages(parse_items, [fetched[position][0] for position in positions])))
+            page_parse_seconds = (time.perf_counter() - parse_start) / max(len(positions), 1)
+        for position, ((index, page_number), url, (page, seconds, error)) in enumerate(zip(pending, urls, fetched)):
+            search = searches[index]
+            state = progress[index]
+            # 同じラウンドのページは並列に取得しているため、最も遅いページの時間を足す
+            round_seconds[index] = max(round_seconds.get(index, 0.0), seconds)
+            if index in done:
+                continue
+            if error is not None:
+                if page_number == 1:
+                    state["error"] = error
+                elif getattr(getattr(error, "response", None), "status_code", None) != 404:
+                    # 最後のページより先は404になるため、それ以外のみ表示する
+                    print(f"[{search['name']}] {page_number}ページ目の取得に失敗しました: {error}")
+                done.add(index)
+                continue
+            state["urls"].append(url)
+            if page is None:
+                # 前回から変わっていないページより先は辿らない
+                state["cached"] = state["cached"] or page_number == 1
+                done.add(index)
+                continue
+            # ストリームで解析した場合は、読み終えた商品のリストが返っている
+            parse_start = time.perf_counter()
+            listings = page if early_exit else parsed[position]
+            accept = rules[index]
+            accepted = listings if accept is None else [listing for listing in listings if accept(listing)]
+            # ページをまたいで重複した商品は1件にまとめる
+            for listing in accepted:
+                if listing.url not in state["seen"]:
+                    state["seen"].add(listing.url)
+                    state["listings"].append(listing)
+                    state["items"].append(listing.to_dict())
+            # まとめて解析した時間はページ数で割って各ページに配る
+            state["parse_seconds"] += time.perf_counter() - parse_start + page_parse_seconds
+            state["pages"] += 1
+            state["rejected"] += len(listings) - len(accepted)
+            max_pages = search.get("max_pages", 1)
+            if (
+                not listings
+                or page_number >= max_pages
+                or reached_known(listings, checkers[index], early_exit or 1, accept)
+            ):
+                done.add(index)
+            elif page_number == last_pages[index]:
+                if all(previous_data for previous_data, _ in subscriptions(search, states)):
+                    next_pending.append((index, page_number + 1))
+                else:
+                    # 初回は残りのページをまとめて取得する
+                    next_pending.extend((index, number) for number in range(page_number + 1, max_pages + 1))
+        for index, seconds in round_seconds.items():
+            progress[index]["fetch_seconds"] += seconds
+        pending = next_pending
+    for state in progress:
+        del state["seen"]
+    return progress
@@ -0,0 +1,371 @@
+import contextlib
+import json
+import threading
+import time
+
+from .crawler import crawl
+from .fetcher import Fetcher
+from .history import annotate
+from .metrics import metrics
+from .parsers import get_parser, has_lxml, parse_items_bs4
+from .planner import plan
+from .rules import get_rules
+from .scraper import build_url
+from .store import load_state, save_state
+
+DEFAULT_STATE = "previous_data.json"
+
+# 同じ状態ファイルを使う検索が別々のスレッドで同時に動いても、重複判定と保存が混ざらないようにする
+_state_locks = {}
+_state_locks_lock = threading.Lock()
+
+
+def state_lock(filename):
+    """状態ファイルごとのロックを返す"""
+    with _state_locks_lock:
+        return _state_locks.setdefault(filename, threading.Lock())
+
+
+def forget(data, urls):
+    """通知できなかった商品を状態から外し、次のティックで新着として扱う"""
+    if hasattr(data, "forget"):
+        data.forget(urls)
+        return
+    for url in urls:
+        data.pop(url, None)
+
+
+def forget_undelivered(states, undelivered, dirty):
+    """送れなかった通知の商品を、読み込んだ状態から外す。外した状態ファイルの集合を返す"""
+    forgotten = set()
+    for filename, urls in undelivered(set(states)).items():
+        try:
+            with state_lock(filename):
+                forget(states[filename], urls)
+            dirty.add(filename)
+        except Exception as e:
+            print(f"通知できなかった商品を戻せませんでした({filename}): {e}")
+            continue
+        forgotten.add(filename)
+        metrics.increment("jmty_undelivered_total", len(urls))
+        print(f"通知できなかった{len(urls)}件を次のティックで通知し直します({filename})")
+    return forgotten
+
+
+def discard_pages(fetcher, fetches, filenames):
+    """状態から外した商品を拾い直せるよう、その状態を使う検索の一覧ページの検証子を捨てる
+
+    商品がどのページにあったかは覚えていないため、max_pagesまでの全てのページを対象にする。
+    検証子が残っていると次のティックは304(変更なし)になり、外した商品が通知されない。
+    """
+    if not filenames:
+        return
+    fetcher.discard(
+        [
+            build_url(fetch, page)
+            for fetch in fetches
+            if any(search["state"] in filenames for search in fetch.get("subscribers", [fetch]))
+            for page in range(1, fetch.get("max_pages", 1) + 1)
+        ]
+    )
+
+
+def load_config(filename):
+    """検索条件とその他の設定をファイル(JSON/YAML)から読み込む"""
+    with open(filename, "r") as file:
+        if filename.endswith((".yaml", ".yml")):
+            import yaml  # YAMLで書く場合のみPyYAMLが必要
+
+            config = yaml.safe_load(file)
+        else:
+            config = json.load(file)
+    if not isinstance(config, dict):
+        config = {"searches": config}
+    for index, search in enumerate(config["searches"]):
+        search.setdefault("name", search.get("keyword") or f"search{index + 1}")
+        # seen_indexを指定すると、状態ファイルを書いていない全ての検索で1つの既読一覧を共有する
+        search.setdefault("state", config.get("seen_index", DEFAULT_STATE))
+        search.setdefault("max_pages", config.get("max_pages", 1))
+        # 正規表現の誤りは起動時に分かるよう、ここでコンパイルしておく
+        get_rules(search)
+    if config.get("shard"):
+        from .coordinator import check_states
+
+        # 同じ商品を複数のワーカーが通知しないよう、状態が共有できない設定は起動時に断る
+        check_states(config["searches"])
+    return config
+
+
+def load_searches(filename):
+    """検索条件の一覧をファイルから読み込む"""
+    return load_config(filename)["searches"]
+
+
+def create_fetcher(config):
+    """設定ファイルの"fetch"項目からHTTPクライアントを作る"""
+    return Fetcher(**config.get("fetch", {}))
+
+
+def create_parser(config):
+    """設定ファイルの"parser"項目から一覧ページの解析関数を選ぶ
+
+    "parse_pool"項目があれば、別プロセスのワーカーで解析するParserPoolを起動して返す。
+    """
+    if config.get("parse_pool"):
+        from .parsepool import ParserPool
+
+        pool = ParserPool(config.get("parser", "html.parser"), **config["parse_pool"])
+        pool.warm_up()
+        return pool
+    return get_parser(config.get("parser", "html.parser"))
+
+
+def print_timings(results, total_seconds, cache=None):
+    """検索ごとの所要時間を表示する"""
+    for result in results:
+        if result["error"]:
+            status = f"エラー: {result['error']}"
+        elif result["cached"]:
+            status = "変更なし"
+        else:
+            status = f"{result['pages']}ページ 取得{result['scraped']}件 / 新着{result['new']}件"
+            if result["rejected"]:
+                status += f" / 除外{result['rejected']}件"
+            if result["price_drops"]:
+                status += f" / 値下げ{result['price_drops']}件"
+        print(f"[{result['name']}] {result['seconds']:.2f}秒 (取得 {result['fetch_seconds']:.2f}秒) {status}")
+    print(f"合計 {len(results)}件の検索: {total_seconds:.2f}秒")
+    if cache is not None:
+        print(f"HTTPキャッシュ: ヒット{cache.hits}件 (304: {cache.not_modified}件 / 同一本文: {cache.unchanged}件) / ミス{cache.misses}件")
+
+
+def record_result(result):
+    """検索1件分のステージごとの所要時間を集計し、JSONログに出す"""
+    for stage in ("fetch", "parse", "dedup", "handle"):
+        metrics.observe("jmty_stage_seconds", result[f"{stage}_seconds"], stage=stage, search=result["name"])
+    metrics.increment("jmty_ticks_total", search=result["name"])
+    metrics.increment("jmty_new_listings_total", result["new"], search=result["name"])
+    metrics.increment("jmty_rejected_listings_total", result["rejected"], search=result["name"])
+    metrics.increment("jmty_price_drops_total", result["price_drops"], search=result["name"])
+    metrics.increment("jmty_relists_total", result["relists"], search=result["name"])
+    if result["error"]:
+        metrics.increment("jmty_errors_total", search=result["name"])
+    metrics.log("search", **result)
+
+
+def claim_new_items(states, pending):
+    """claim()を持つ共有ストアで、このティックの新着商品を他のワーカーより先に取る
+
+    状態ファイルごとに、取れた商品URLの集合(失敗した場合は例外)を返す。
+    同じ商品に該当する検索が複数あっても、取るのはティックごとに1回だけにする。
+    """
+    claimed = {}
+    for filename, state in states.items():
+        if not hasattr(state, "claim"):
+            continue
+        candidates = {}
+        for search, _, result, new_items, _, _ in pending:
+            if search["state"] == filename and result["error"] is None:
+                candidates.update((item["商品URL"], item) for item in new_items)
+        if not candidates:
+            continue
+        try:
+            claimed[filename] = {item["商品URL"] for item in state.claim(candidates.values())}
+        except Exception as e:
+            claimed[filename] = e
+    return claimed
+
+
+def run_searches(
+    searches,
+    on_new_items,
+    load_state=load_state,
+    save_state=save_state,
+    fetcher=None,
+    parse_items=parse_items_bs4,
+    early_exit=0,
+    merge_keywords=False,
+    history=None,
+    on_price_drops=None,
+    archive=None,
+    undelivered=None,
+):
+    """全ての検索を1回ずつ実行し、検索ごとの結果と所要時間を返す
+
+    一覧ページは共有のHTTPクライアントでまとめて並列に取得し、状態ファイルは検索間で共有する。
+    状態の保存はティックの最後に1回だけ行う。
+    early_exitを指定すると一覧ページをストリームで解析し、既知の商品がその件数続いた時点で読むのをやめる。
+    max_pagesを指定した検索は、既知の商品に届くまで2ページ目以降も辿る。
+    重なる検索はplanner.planでまとめて1回だけ取得し、取得した商品を該当する全ての検索に振り分ける。
+    historyを渡すと一覧で見た全ての商品の価格を記録し、値下げした既知の商品をon_price_dropsに渡す。
+    再出品と思われる新着商品には"前回の出品"を付けて通知する。
+    archiveを渡すと、検索ごとに該当した全ての商品をアーカイブに追記する。
+    undelivered(状態ファイルの集合)は送れなかった新着の{状態ファイル: URL}を返す関数で、
+    ティックの最初と保存の直前に呼び、返された商品を状態から外して次のティックで通知し直す。
+    その状態を使う検索の一覧ページは、HTTPキャッシュの検証子も捨てて取得し直す。
+    """
+    fetcher = fetcher or Fetcher()
+    states = {}
+    state_errors = {}
+    dirty = set()
+    tick_start = time.perf_counter()
+    # 初見から通知までの時間は、一覧ページを取りに行った時刻から測る
+    seen_at = time.time()
+    for filename in {search["state"] for search in searches}:
+        try:
+            states[filename] = load_state(filename)
+        except Exception as e:
+            state_errors[filename] = e
+    fetches = plan(searches, merge_keywords)
+    if undelivered is not None:
+        # 前のティックの後に送れなかった通知を、このティックで新着として拾い直す
+        discard_pages(fetcher, fetches, forget_undelivered(states, undelivered, dirty))
+    if early_exit and not has_lxml():
+        print("lxmlがインストールされていないため、一覧ページを最後まで解析します")
+        early_exit = 0
+    crawled = crawl(fetches, fetcher, states, parse_items, early_exit)
+    order = {id(search): index for index, search in enumerate(searches)}
+    pending = []
+    failed_urls = set()
+    # 全ての検索の新着を判定してから保存し、同じ商品が該当する全ての検索に届くようにする
+    with contextlib.ExitStack() as locks:
+        for filename in sorted(states):
+            locks.enter_context(state_lock(filename))
+        for fetch, page in zip(fetches, crawled):
+            changes = {}
+            if history is not None and page["error"] is None and page["items"]:
+                try:
+                    events = history.observe(page["items"], seen_at, scope=fetch["name"])
+                    changes = {item["商品URL"]: (kind, previous) for kind, item, previous in events}
+                except Exception as e:
+                    print(f"[{fetch['name']}] 価格の履歴の保存中にエラーが発生しました: {e}")
+            for search, accept in zip(fetch["subscribers"], fetch["filters"]):
+                result = {
+                    "name": search["name"],
+                    "scraped": 0,
+                    "new": 0,
+                    "pages": page["pages"],
+                    "rejected": page["rejected"],
+                    "seconds": 0.0,
+                    "fetch_seconds": page["fetch_seconds"],
+                    "parse_seconds": page["parse_seconds"],
+                    "dedup_seconds": 0.0,
+                    "handle_seconds": 0.0,
+                    "price_drops": 0,
+                    "relists": 0,
+                    "cached": page["cached"],
+                    "error": None,
+                }
+                new_items = []
+                price_drops = []
+                try:
+                    if page["error"] is not None:
+                        raise page["error"]
+                    if search["state"] in state_errors:
+                        raise state_errors[search["state"]]
+                    previous_data = states[search["state"]]
+                    dedup_start = time.perf_counter()
+                    # まとめて取得した商品から、この検索に該当するものを選ぶ
+                    scraped_items = page["items"]
+                    if accept is not None:
+                        scraped_items = [
+                            item for item, listing in zip(page["items"], page["listings"]) if accept(listing)
+                        ]
+                    result["scraped"] = len(scraped_items)
+                    result["rejected"] += len(page["items"]) - len(scraped_items)
+                    if archive is not None and scraped_items:
+                        try:
+                            archive.append(search, scraped_items, seen_at)
+                        except Exception as e:
+                            print(f"[{search['name']}] アーカイブへの追記中にエラーが発生しました: {e}")
+                    # previous_dataにない商品のみを新しい商品として扱う
+                    new_items = [item for item in scraped_items if item["商品URL"] not in previous_data]
+                    result["dedup_seconds"] = time.perf_counter() - dedup_start
+                    result["new"] = len(new_items)
+                    if changes:
+                        price_drops = [
+                            annotate(item, *changes[item["商品URL"]])
+                            for item in scraped_items
+                            if changes.get(item["商品URL"], ("",))[0] == "price_drop"
+                        ]
+                        result["price_drops"] = len(price_drops)
+                        result["relists"] = sum(item["商品URL"] in changes for item in new_items)
+                except Exception as e:
+                    result["error"] = str(e)
+                pending.append((search, page, result, new_items, changes, price_drops))
+        claimed = claim_new_items(states, pending)
+        handled = set()
+        unhandled = set()
+        for search, page, result, new_items, changes, price_drops in pending:
+            start = time.perf_counter()
+            if search["state"] in claimed and result["error"] is None:
+                if isinstance(claimed[search["state"]], Exception):
+                    result["error"] = str(claimed[search["state"]])
+                else:
+                    # 他のワーカーが先に保存した商品は通知しない
+                    new_items = [item for item in new_items if item["商品URL"] in claimed[search["state"]]]
+                    result["new"] = len(new_items)
+            if new_items and result["error"] is None:
+                try:
+                    metrics.mark_seen([item["商品URL"] for item in new_items], seen_at)
+                    # 再出品の商品は前回の出品を付けて通知し、previous_dataには元の商品を保存する
+                    notify_items = [
+                        annotate(item, *changes[item["商品URL"]]) if item["商品URL"] in changes else item
+                        for item in new_items
+                    ]
+                    on_new_items(search, notify_items)
+                    # 通知できた商品のみprevious_dataに含める
+                    previous_data = states[search["state"]]
+                    for item in new_items:
+                        previous_data[item["商品URL"]] = item
+                    dirty.add(search["state"])
+                    handled.update((search["state"], item["商品URL"]) for item in new_items)
+                except Exception as e:
+                    result["error"] = str(e)
+                    unhandled.update((search["state"], item["商品URL"]) for item in new_items)
+                result["handle_seconds"] = time.perf_counter() - start
+            if price_drops and on_price_drops is not None and result["error"] is None:
+                try:
+                    on_price_drops(search, price_drops)
+                except Exception as e:
+                    print(f"[{search['name']}] 値下げの通知中にエラーが発生しました: {e}")
+            result["seconds"] = page["fetch_seconds"] + result["dedup_seconds"] + time.perf_counter() - start
+            if result["error"]:
+                failed_urls.update(page["urls"])
+        # 取ったが通知できなかった商品は、次のティック(または他のワーカー)で通知し直せるよう戻す
+        returned = {}
+        for filename, url in unhandled - handled:
+            if filename in claimed:
+                returned.setdefault(filename, []).append(url)
+        for filename, urls in returned.items():
+            try:
+                states[filename].unclaim(urls)
+            except Exception as e:
+                print(f"通知できなかった商品を戻せませんでした({filename}): {e}")
+    results = [entry[2] for entry in sorted(pending, key=lambda entry: order[id(entry[0])])]
+    for result in results:
+        record_result(result)
+
+    # 処理に失敗したページは次回も解析し直せるよう、成功したページの検証子のみ確定する
+    for page in crawled:
+        for url in page["urls"]:
+            if url not in failed_urls:
+                fetcher.commit(url)
+    if undelivered is not None:
+        # 確定した検証子も、送れなかった商品のページの分は捨てて次のティックで取得し直す
+        discard_pages(fetcher, fetches, forget_undelivered(states, undelivered, dirty))
+    if fetcher.cache is not None:
+        for key, value in fetcher.cache.stats().items():
+            metrics.set_counter(f"jmty_http_cache_{key}_total", value)
+        try:
+            fetcher.cache.save()
+        except Exception as e:
+            print(f"HTTPキャッシュの保存中にエラーが発生しました: {e}")
+    for filename in dirty:
+        try:
+            with state_lock(filename):
+                save_state(filename, states[filename])
+        except Exception as e:
+            print(f"データの保存中にエラーが発生しました({filename}): {e}")
+    print_timings(results, time.perf_counter() - tick_start, fetcher.cache)
+    return results
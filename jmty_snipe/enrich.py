@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from . import scraper
+from .listing import article_id
+from .metrics import metrics
+from .scraper import parse_page
+
+# 記事ページの表(見出しと値)から拾う項目と、その見出し
+COLUMN_LABELS = {
+    "状態": ("状態", "商品の状態"),
+    "エリア": ("地域", "エリア", "取引場所"),
+}
+
+
+def _text(element):
+    return " ".join(element.get_text(" ").split()) if element is not None else ""
+
+
+def parse_article(content):
+    """記事ページから説明・写真・出品者・状態・エリアを取り出す"""
+    bs = parse_page(content)
+    description = _text(bs.find("div", {"class": "p-article-text"}))
+    if not description:
+        meta = bs.find("meta", {"name": "description"})
+        description = meta.get("content", "").strip() if meta else ""
+    photos = []
+    for image in bs.select(".p-article-image-container img, img.p-article-image"):
+        source = image.get("src") or image.get("data-src")
+        if source and source not in photos:
+            photos.append(source)
+    if not photos:
+        og_image = bs.find("meta", {"property": "og:image"})
+        if og_image and og_image.get("content"):
+            photos.append(og_image["content"])
+    columns = {}
+    for title in bs.select(".p-article-column-title, .p-article-column th, .p-article-column dt"):
+        value = title.find_next_sibling(["td", "dd"]) or title.find_next(class_="p-article-column-value")
+        columns.setdefault(_text(title), _text(value))
+    details = {
+        "説明": description,
+        "画像": photos,
+        "出品者": _text(bs.find(class_="p-article-author-name")),
+    }
+    for field, labels in COLUMN_LABELS.items():
+        details[field] = next((columns[label] for label in labels if columns.get(label)), "")
+    return details
+
+
+def local_url(url):
+    """jmty.jpのURLを、BASE_URLを差し替えている場合はそのサーバーのURLにする"""
+    if scraper.BASE_URL == "https://jmty.jp":
+        return url
+    parts = urlsplit(url)
+    return scraper.BASE_URL + parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+class DetailCache:
+    """記事ごとの詳細を、記事IDのハッシュをファイル名にして保存するキャッシュ
+
+    同じ記事の詳細は一度保存すれば再び取得しない。ファイルは書き終えてから置き換える。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        digest = hashlib.sha1(article_id(url).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, url):
+        try:
+            with open(self.path(url), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, url, details):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(details, file, ensure_ascii=False)
+        os.replace(temporary, path)
+
+
+class Enricher:
+    """新着商品の記事ページを別のスレッドで取得し、詳細を付けてon_enrichedに渡す
+
+    一覧からの通知を先に送り、詳細は揃った検索から追って送るため、最初の通知は遅れない。
+    同時に取得する記事ページはmax_workers件までに抑える。
+    """
+
+    def __init__(self, fetcher, on_enriched, cache=None, max_workers=4):
+        self.fetcher = fetcher
+        self.on_enriched = on_enriched
+        self.cache = DetailCache(cache) if cache else None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="enrich")
+        self._pending = 0
+        self._idle = threading.Condition()
+
+    def fetch_details(self, url):
+        """記事ページの詳細を返す。キャッシュにあれば取得しない"""
+        if self.cache is not None:
+            details = self.cache.get(url)
+            if details is not None:
+                metrics.increment("jmty_enrich_cache_hits_total")
+                return details
+        with metrics.timer("jmty_stage_seconds", stage="enrich"):
+            details = parse_article(self.fetcher.get(local_url(url), priority="enrich").content)
+        # 何も取れなかった場合はページの構成が変わった可能性があるため保存しない
+        if self.cache is not None and any(details.values()):
+            self.cache.put(url, details)
+        return details
+
+    def _enrich(self, search, items):
+        start = time.perf_counter()
+        futures = [self.executor.submit(self.fetch_details, item["商品URL"]) for item in items]
+        enriched = []
+        for item, future in zip(items, futures):
+            try:
+                details = future.result()
+                # 記事ページから何も取れなかった商品は追って通知しない
+                if any(details.values()):
+                    enriched.append({**item, **details})
+            except Exception as e:
+                print(f"[{search['name']}] 詳細の取得に失敗しました({item['商品URL']}): {e}")
+                metrics.increment("jmty_enrich_failures_total", search=search["name"])
+        metrics.observe("jmty_enrich_batch_seconds", time.perf_counter() - start, search=search["name"])
+        if enriched:
+            self.on_enriched(search, enriched)
+
+    def submit(self, search, items):
+        """新着商品の詳細の取得を始める。取得を待たずに戻る"""
+        if not items:
+            return
+        with self._idle:
+            self._pending += 1
+        threading.Thread(target=self._run, args=(search, list(items)), name="enrich-batch", daemon=True).start()
+
+    def _run(self, search, items):
+        try:
+            self._enrich(search, items)
+        except Exception as e:
+            print(f"[{search['name']}] 詳細の通知中にエラーが発生しました: {e}")
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def flush(self, timeout=None):
+        """取得中の詳細を全て渡し終えるまで待つ。終わればTrueを返す"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_enricher(config, fetcher, on_enriched):
+    """設定ファイルの"enrich"項目から詳細の取得を作る。項目がなければNoneを返す"""
+    options = config.get("enrich")
+    if not options:
+        return None
+    return Enricher(fetcher, on_enriched, **options)
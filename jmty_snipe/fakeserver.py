@@ -0,0 +1,209 @@
+import hashlib
+import os
+import socketserver
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class FixtureServer:
+    """保存したHTMLをjmty.jpの代わりに返すローカルHTTPサーバー
+
+    パスごとのファイルがあればそれを、なければdefault.htmlを返す。
+    build_url()にbase_urlとしてserver.urlを渡すと、実サイトに接続せずに確認できる。
+    errorsに{パス: [ステータス, ...]}を入れると、そのパスへのリクエストに先頭から順にそのステータスを返す。
+    """
+
+    def __init__(self, directory, port=0, delay=0):
+        self.directory = directory
+        self.delay = delay
+        self.requests = []
+        self.errors = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                if server.delay:
+                    threading.Event().wait(server.delay)
+                status = server.next_error(self.path)
+                if status is not None:
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = server.find_fixture(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def next_error(self, path):
+        """パスに返すエラーのステータスが残っていれば取り出す"""
+        with self._lock:
+            statuses = self.errors.get(urlsplit(path).path)
+            return statuses.pop(0) if statuses else None
+
+    def find_fixture(self, path):
+        """リクエストパスに対応するHTMLファイルを読み込む"""
+        name = urlsplit(path).path.strip("/").replace("/", "_") or "index"
+        for candidate in (f"{name}.html", "default.html"):
+            filename = os.path.join(self.directory, candidate)
+            if os.path.exists(filename):
+                with open(filename, "rb") as file:
+                    return file.read()
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class WebhookReceiver:
+    """通知先(LINE/Slack/Discord/Webhook)の代わりに、POSTされた内容を記録するローカルHTTPサーバー
+
+    rate_limitを指定すると、その件数ごとに1回429とRetry-After: 1を返す。
+    """
+
+    def __init__(self, rate_limit=0, delay=0):
+        self.rate_limit = rate_limit
+        self.delay = delay
+        self.received = []
+        self._count = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if server.delay:
+                    threading.Event().wait(server.delay)
+                with server._lock:
+                    server._count += 1
+                    limited = server.rate_limit and server._count % (server.rate_limit + 1) == 0
+                    if not limited:
+                        server.received.append({"path": self.path, "headers": dict(self.headers), "body": body})
+                if limited:
+                    self.send_response(429)
+                    self.send_header("Retry-After", "1")
+                    self.end_headers()
+                    return
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class SmtpReceiver:
+    """EmailNotifierの確認用に、受け取ったメールを記録するだけの最小限のSMTPサーバー
+
+    STARTTLSには対応しないため、EmailNotifierはstarttls=Falseで接続する。
+    """
+
+    def __init__(self):
+        self.messages = []
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                self.reply("220 localhost")
+                while True:
+                    line = self.rfile.readline().decode().strip()
+                    command = line[:4].upper()
+                    if not line or command == "QUIT":
+                        self.reply("221 bye")
+                        return
+                    if command in ("EHLO", "HELO"):
+                        self.reply("250 localhost")
+                    elif command == "DATA":
+                        self.reply("354 end with .")
+                        lines = []
+                        while (data := self.rfile.readline().decode()) not in (".\r\n", ".\n", ""):
+                            lines.append(data)
+                        server.messages.append("".join(lines))
+                        self.reply("250 ok")
+                    else:
+                        self.reply("250 ok")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    # python -m jmty_snipe.fakeserver <ディレクトリ> <ポート>
+    server = FixtureServer(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
+    print(f"{server.url} で待ち受け中")
+    server.httpd.serve_forever()
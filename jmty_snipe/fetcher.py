@@ -0,0 +1,165 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .httpcache import HttpCache
+from .ratelimit import SLOW_DOWN_STATUSES, RequestScheduler
+
+USER_AGENT = "Mozilla/5.0 (compatible; jmty-snipe)"
+CHUNK_SIZE = 16 * 1024
+
+
+class Fetcher:
+    """コネクションプールを共有し、複数のURLを並列に取得するHTTPクライアント"""
+
+    def __init__(
+        self,
+        max_workers=8,
+        per_host=4,
+        timeout=15,
+        connect_timeout=5,
+        retries=3,
+        backoff=0.5,
+        cache=None,
+        rate=None,
+        burst=5,
+    ):
+        self.timeout = (connect_timeout, timeout)
+        # rateを指定すると、全てのリクエストを1つのトークンバケットに通す
+        self.scheduler = RequestScheduler(rate, burst) if rate else None
+        # cacheにファイルパスを指定すると条件付きGETを使う
+        self.cache = HttpCache(cache) if cache else None
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        # 接続エラーはurllib3が指数バックオフで再試行する。429/5xxの再試行もスケジューラーを通すため、
+        # ステータスによる再試行はget()/stream_if_modified()で行う
+        retry = Retry(total=retries, backoff_factor=backoff, status=0, allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers, max_retries=retry, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url):
+        """ホストごとの同時接続数を制限するセマフォを返す"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_limits[host]
+
+    def _wait_turn(self, priority):
+        """スケジューラーを使う場合、送ってよくなるまで待つ
+
+        ホストごとのセマフォより先に待つので、待っている低優先度のリクエストが接続枠を塞がない。
+        """
+        if self.scheduler is not None:
+            self.scheduler.acquire(priority)
+
+    def _send(self, url, headers=None, stream=False):
+        """リクエストを送り、応答のステータスをスケジューラーに伝える"""
+        response = self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+        if self.scheduler is not None:
+            self.scheduler.feedback(response)
+        return response
+
+    def _should_retry(self, response, attempt):
+        """429/5xxを再試行するならTrueを返す"""
+        return response.status_code in SLOW_DOWN_STATUSES and attempt < self.retries
+
+    def _retry_wait(self, response, attempt):
+        """再試行までの秒数。スケジューラーはRetry-Afterの間トークンを出さないため、その場合は待たない"""
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return 0 if self.scheduler is not None else float(retry_after)
+        return self.backoff * 2**attempt
+
+    def get(self, url, headers=None, priority="poll"):
+        """URLのレスポンスを取得する。429/5xxは再試行のたびにスケジューラーを通す"""
+        for attempt in range(self.retries + 1):
+            self._wait_turn(priority)
+            with self._host_limit(url):
+                response = self._send(url, headers)
+            if not self._should_retry(response, attempt):
+                break
+            response.close()
+            time.sleep(self._retry_wait(response, attempt))
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def get_if_modified(self, url, priority="poll"):
+        """前回から変わっていればURLの本文を、変わっていなければNoneを返す"""
+        if self.cache is None:
+            return self.get(url, priority=priority).content
+        response = self.get(url, headers=self.cache.request_headers(url), priority=priority)
+        return response.content if self.cache.check(url, response) else None
+
+    def stream_if_modified(self, url, consume, priority="poll"):
+        """本文を少しずつconsumeに渡し、その戻り値を返す。変わっていなければNoneを返す
+
+        consumeが途中で読むのをやめた場合、残りの本文は受信せずに接続を閉じる。
+        """
+        headers = self.cache.request_headers(url) if self.cache is not None else None
+        for attempt in range(self.retries + 1):
+            self._wait_turn(priority)
+            with self._host_limit(url):
+                response = self._send(url, headers, stream=True)
+                try:
+                    if not self._should_retry(response, attempt):
+                        if response.status_code != 304:
+                            response.raise_for_status()
+                        if self.cache is not None and not self.cache.check_stream(url, response):
+                            return None
+                        return consume(response.iter_content(CHUNK_SIZE))
+                finally:
+                    response.close()
+            # 待つ間はホストの接続枠を空けておく
+            time.sleep(self._retry_wait(response, attempt))
+
+    def _timed_get(self, url, consume=None, priority="poll"):
+        start = time.perf_counter()
+        try:
+            if consume is None:
+                page = self.get_if_modified(url, priority)
+            else:
+                page = self.stream_if_modified(url, consume, priority)
+            return page, time.perf_counter() - start, None
+        except Exception as e:
+            return None, time.perf_counter() - start, e
+
+    def fetch_all(self, urls, consumers=None, priorities=None):
+        """複数のURLを並列に取得し、(本文, 所要秒数, 例外)のリストを同じ順序で返す
+
+        キャッシュを使う場合、前回から変わっていないページの本文はNoneになる。
+        consumersを渡すと本文の代わりに、ストリームを読んだ各consumerの戻り値を返す。
+        prioritiesはスケジューラーを使う場合の各URLの優先度。
+        """
+        return list(
+            self.executor.map(
+                self._timed_get, urls, consumers or [None] * len(urls), priorities or ["poll"] * len(urls)
+            )
+        )
+
+    def commit(self, url):
+        """ページの処理が終わったことをキャッシュに伝える"""
+        if self.cache is not None:
+            self.cache.commit(url)
+
+    def discard(self, urls):
+        """キャッシュしたページの検証子を捨てる"""
+        if self.cache is not None:
+            self.cache.discard(urls)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
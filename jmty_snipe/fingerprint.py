@@ -0,0 +1,123 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+
+from .listing import article_id
+from .store import SeenStore
+
+MAGIC = b"JMTYBLM1"
+# マジック, ビット数, ハッシュ関数の数, 登録件数
+HEADER = struct.Struct("<8sQII")
+
+
+def bloom_size(capacity, error_rate):
+    """件数と誤判定率から(ビット数, ハッシュ関数の数)を求める"""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class BloomFilter:
+    """1つのバイナリファイルをmmapで開くBloomフィルター
+
+    読み込み時にファイルをコピーしないため、件数が多くても起動がほぼ一定時間で済む。
+    """
+
+    def __init__(self, filename, capacity=1_000_000, error_rate=1e-6):
+        if not os.path.exists(filename):
+            bits, hashes = bloom_size(capacity, error_rate)
+            with open(filename, "wb") as file:
+                file.write(HEADER.pack(MAGIC, bits, hashes, 0))
+                file.truncate(HEADER.size + (bits + 7) // 8)
+        self.file = open(filename, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.bits, self.hashes, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Bloomフィルターのファイルではありません: {filename}")
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = struct.unpack("<QQ", digest)
+        # ダブルハッシュでk個の位置を作る
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.map[HEADER.size + position // 8] & (1 << position % 8) for position in self._positions(key))
+
+    def add(self, key):
+        if key in self:
+            return
+        for position in self._positions(key):
+            offset = HEADER.size + position // 8
+            self.map[offset] |= 1 << position % 8
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def error_rate(self):
+        """現在の登録件数での誤判定率の見積もり"""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def flush(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.bits, self.hashes, self.count)
+        self.map.flush()
+
+    def close(self):
+        self.flush()
+        self.map.close()
+        self.file.close()
+
+
+class FingerprintState:
+    """記事IDのBloomフィルターで重複を判定し、商品の詳細は別のSQLiteに置く状態
+
+    previous_dataの辞書と同じく `url in state` と `state[url] = item` で使える。
+    誤判定(新着を既知と判定)の確率はerror_rate以下に抑えられる。
+    Bloomフィルターからは消せないため、通知できなかった記事IDは別のファイルに除外として持つ。
+    """
+
+    def __init__(self, filename, capacity=1_000_000, error_rate=1e-6):
+        self.filter = BloomFilter(filename, capacity, error_rate)
+        self.target_error_rate = error_rate
+        self.cold = SeenStore(filename + ".db")
+        self.forgotten_file = filename + ".forgotten.json"
+        self.forgotten = set()
+        if os.path.exists(self.forgotten_file):
+            with open(self.forgotten_file) as file:
+                self.forgotten = set(json.load(file))
+
+    def __contains__(self, url):
+        key = article_id(url)
+        return key in self.filter and key not in self.forgotten
+
+    def __setitem__(self, url, item):
+        self.filter.add(article_id(url))
+        self.forgotten.discard(article_id(url))
+        self.cold[url] = item
+
+    def forget(self, urls):
+        """通知できなかった商品を除外に加え、次のティックで新着として扱う"""
+        self.forgotten.update(article_id(url) for url in urls)
+        self.cold.forget(urls)
+
+    def __getitem__(self, url):
+        return self.cold[url]
+
+    def __bool__(self):
+        return self.filter.count > 0
+
+    def __len__(self):
+        return self.filter.count
+
+    def commit(self):
+        self.filter.flush()
+        self.cold.commit()
+        if self.forgotten or os.path.exists(self.forgotten_file):
+            with open(self.forgotten_file, "w") as file:
+                json.dump(sorted(self.forgotten), file)
+        if self.filter.error_rate() > self.target_error_rate * 10:
+            print(f"Bloomフィルターの件数が想定を超えています(誤判定率 {self.filter.error_rate():.1e})")
@@ -0,0 +1,129 @@
+import json
+import time
+import uuid
+
+# 差分がこの件数を超えたら、次の保存時にベースのスナップショットへまとめる
+COMPACT_AFTER = 50
+# 読み込み中にまとめられた場合に読み込み直す回数
+LOAD_ATTEMPTS = 5
+
+
+class GcsState:
+    """Cloud Storage上の既知の商品(ベースのスナップショット + 差分オブジェクト)
+
+    previous_dataの辞書と同じく `url in state` と `state[url] = item` で使える。
+    追加した商品はcommit()で1つの小さな差分オブジェクトとして新規作成するため、
+    同時に動いた別の起動の書き込みを上書きすることはない。
+    """
+
+    def __init__(self, bucket, name, compact_after=COMPACT_AFTER):
+        self.bucket = bucket
+        self.name = name
+        self.compact_after = compact_after
+        self.pending = {}
+        self.data = {}
+        self.base_generation = 0
+        self.deltas = []
+        self.load()
+
+    @property
+    def delta_prefix(self):
+        return f"{self.name}.delta/"
+
+    def load(self):
+        """ベースと全ての差分を読み込む
+
+        読み込む間に別の起動がまとめた(ベースを更新して差分を削除した)場合は、読み込み直す。
+        """
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+
+        for _ in range(LOAD_ATTEMPTS):
+            base = self.bucket.get_blob(self.name)
+            generation = base.generation if base is not None else 0
+            data = {}
+            deltas = []
+            try:
+                if base is not None:
+                    data = json.loads(base.download_as_bytes(if_generation_match=generation))
+            except PreconditionFailed:
+                continue
+            for blob in sorted(self.bucket.list_blobs(prefix=self.delta_prefix), key=lambda blob: blob.name):
+                try:
+                    data.update(json.loads(blob.download_as_bytes()))
+                except NotFound:
+                    # 一覧を取った後に削除された差分は、既にベースにまとめられている
+                    continue
+                deltas.append(blob)
+            current = self.bucket.get_blob(self.name)
+            if (current.generation if current is not None else 0) == generation:
+                break
+        else:
+            print(f"{self.name}の読み込み中に何度もまとめられたため、最後に読んだ内容を使います")
+        self.base_generation = generation
+        self.data = data
+        self.deltas = deltas
+
+    def __contains__(self, url):
+        return url in self.pending or url in self.data
+
+    def __setitem__(self, url, item):
+        self.pending[url] = item
+
+    def __getitem__(self, url):
+        return self.pending[url] if url in self.pending else self.data[url]
+
+    def __bool__(self):
+        return bool(self.pending or self.data)
+
+    def __len__(self):
+        return len(self.data) + len(self.pending)
+
+    def forget(self, urls):
+        """通知できなかった商品を外す
+
+        差分は新規作成のみのため、commit()の前(通知を待ってから保存する場合)に呼ぶ。
+        書き込み済みの商品はこの起動の中でのみ外れる。
+        """
+        for url in urls:
+            self.pending.pop(url, None)
+            self.data.pop(url, None)
+
+    def commit(self):
+        """溜めた商品を1つの差分オブジェクトとして書き込む"""
+        if not self.pending:
+            return
+        # 名前は時刻順に並ぶようにし、if_generation_match=0で新規作成のみを許可する
+        blob = self.bucket.blob(f"{self.delta_prefix}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json")
+        blob.upload_from_string(
+            json.dumps(self.pending, ensure_ascii=False),
+            content_type="application/json",
+            if_generation_match=0,
+        )
+        self.data.update(self.pending)
+        self.deltas.append(blob)
+        self.pending = {}
+        if len(self.deltas) > self.compact_after:
+            self.compact()
+
+    def compact(self):
+        """読み込んだ差分をベースにまとめる。別の起動が先にまとめていた場合は何もしない"""
+        from google.api_core.exceptions import PreconditionFailed
+
+        base = self.bucket.blob(self.name)
+        try:
+            base.upload_from_string(
+                json.dumps(self.data, ensure_ascii=False),
+                content_type="application/json",
+                if_generation_match=self.base_generation,
+            )
+        except PreconditionFailed:
+            print(f"{self.name}は別の起動で更新されたため、まとめるのをやめました")
+            return
+        self.base_generation = base.generation
+        # まとめた差分のみ削除する(その後に作られた差分は残す)
+        for blob in self.deltas:
+            try:
+                blob.delete()
+            except Exception as e:
+                print(f"差分の削除中にエラーが発生しました({blob.name}): {e}")
+        self.deltas = []
@@ -0,0 +1,194 @@
+import bisect
+import hashlib
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from .archive import GONE_AFTER
+from .listing import article_id, parse_price
+from .rules import normalize
+
+# 再出品の判定に使う価格帯の境界(円)。隣り合う価格帯までは同じ商品とみなす
+PRICE_BANDS = (0, 1000, 3000, 5000, 10000, 20000, 30000, 50000, 100000, 200000)
+# 【値下げ】などの飾りや記号は再出品で変わりやすいため比べない
+DECORATION = re.compile(r"【[^】]*】|\[[^\]]*\]|[\s!-/:-@\[-`{-~、。・★☆♪！？]+")
+
+
+def price_band(price):
+    return bisect.bisect_right(PRICE_BANDS, price or 0) - 1
+
+
+def fingerprint(item):
+    """タイトルと都道府県から、再出品でも変わりにくい指紋を作る"""
+    title = DECORATION.sub("", normalize(item["タイトル"]))
+    location = normalize(item["取引場所"]).split()[0] if item["取引場所"].strip() else ""
+    return hashlib.blake2b(f"{title}|{location}".encode(), digest_size=8).hexdigest()
+
+
+def annotate(item, kind, previous):
+    """通知用に、以前の値を付けた商品のコピーを返す"""
+    if kind == "price_drop":
+        return {**item, "値下げ前": f"{previous['price']:,}円"}
+    price = f"{previous['price']:,}円" if previous["price"] is not None else "不明"
+    return {**item, "前回の出品": f"{previous['url']} ({price})"}
+
+
+class HistoryStore:
+    """記事ごとの価格・お気に入り数の推移をSQLiteに保存するストア
+
+    latestに記事ごとの最新の値を持ち、値が変わったときだけsnapshotsに1行追加する。
+    変化の判定は最新の値とだけ比べるため、履歴が増えても1ティックの処理量は変わらない。
+    pollsには取得(scope)ごとに、最後に一覧を見た時刻と、そのとき見た記事のうち最も古い初見の時刻を持つ。
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS latest (article_id TEXT PRIMARY KEY, url TEXT NOT NULL, price INTEGER,"
+            " favorites INTEGER, fingerprint TEXT NOT NULL, band INTEGER NOT NULL,"
+            " first_seen REAL NOT NULL, last_seen REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots (article_id TEXT NOT NULL, seen_at REAL NOT NULL,"
+            " price INTEGER, favorites INTEGER)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS polls (scope TEXT PRIMARY KEY, polled_at REAL NOT NULL,"
+            " covered_since REAL NOT NULL)"
+        )
+        # scopeの列がない以前の履歴は、GONE_AFTERより長く見ていない記事のみ再出品の候補にする
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(latest)")]
+        if "scope" not in columns:
+            self.conn.execute("ALTER TABLE latest ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS latest_fingerprint ON latest (fingerprint, band)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS snapshots_article ON snapshots (article_id, seen_at)")
+        self.conn.commit()
+
+    def _latest(self, article_ids):
+        rows = {}
+        ids = list(article_ids)
+        # SQLiteの変数の上限を超えないよう分けて問い合わせる
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self.conn.execute(
+                "SELECT article_id, url, price, favorites, first_seen FROM latest"
+                f" WHERE article_id IN ({placeholders})",
+                chunk,
+            ):
+                rows[row[0]] = {"url": row[1], "price": row[2], "favorites": row[3], "first_seen": row[4]}
+        return rows
+
+    def _relisted(self, key, band, now, batch_ids):
+        """同じ指紋で、掲載が終わった記事を探す
+
+        今回見ていないだけの記事は、取得しなかったページや別の時刻に動く検索に載っているかもしれない。
+        GONE_AFTERより長く見ていないか、その記事を見た取得が後で同じ古さの記事まで一覧を見直したのに
+        見つからなかった記事のみ、掲載が終わったとみなす。
+        """
+        rows = self.conn.execute(
+            "SELECT latest.article_id, url, price, last_seen FROM latest LEFT JOIN polls USING (scope)"
+            " WHERE fingerprint = ? AND band BETWEEN ? AND ? AND last_seen < ?"
+            " AND (last_seen < ? OR (polled_at > last_seen AND covered_since <= first_seen))"
+            " ORDER BY last_seen DESC",
+            (key, band - 1, band + 1, now, now - GONE_AFTER),
+        )
+        row = next((row[1:] for row in rows if row[0] not in batch_ids), None)
+        return {"url": row[0], "price": row[1], "last_seen": row[2]} if row else None
+
+    def observe(self, items, now=None, scope=""):
+        """一覧で見た商品を記録し、(種類, 商品, 以前の値)のリストを返す
+
+        種類は値下げした"price_drop"と、別の記事IDで同じ商品が出品された"relist"。
+        nowには1回のティックで同じ時刻を渡し、そのティックで見た記事を再出品の候補から外す。
+        scopeには一覧を取得した単位(取得の名前)を渡し、その取得の記事が消えたかを次回以降に判定できるようにする。
+        """
+        now = now or time.time()
+        events = []
+        with self._lock:
+            latest = self._latest(article_id(item["商品URL"]) for item in items)
+            # 今回の一覧がどこまで古い記事に届いたか。これより新しい記事で見つからないものは掲載が終わっている
+            covered_since = min((row["first_seen"] for row in latest.values()), default=now)
+            snapshots = []
+            upserts = []
+            touched = []
+            fresh = []
+            for item in items:
+                current_id = article_id(item["商品URL"])
+                price = parse_price(item["価格"])
+                favorites = parse_price(item.get("お気に入り数", "")) or 0
+                previous = latest.get(current_id)
+                if previous is None:
+                    key = fingerprint(item)
+                    band = price_band(price)
+                    fresh.append((item, key, band, current_id))
+                    upserts.append((current_id, item["商品URL"], price, favorites, key, band, now, now, scope))
+                    snapshots.append((current_id, now, price, favorites))
+                    latest[current_id] = {"url": item["商品URL"], "price": price, "favorites": favorites}
+                elif previous["price"] != price or previous["favorites"] != favorites:
+                    if price is not None and previous["price"] is not None and price < previous["price"]:
+                        events.append(("price_drop", item, previous))
+                    upserts.append(
+                        (
+                            current_id,
+                            item["商品URL"],
+                            price,
+                            favorites,
+                            fingerprint(item),
+                            price_band(price),
+                            now,
+                            now,
+                            scope,
+                        )
+                    )
+                    snapshots.append((current_id, now, price, favorites))
+                    latest[current_id] = {"url": item["商品URL"], "price": price, "favorites": favorites}
+                else:
+                    touched.append((now, scope, current_id))
+            self.conn.executemany(
+                "INSERT INTO latest"
+                " (article_id, url, price, favorites, fingerprint, band, first_seen, last_seen, scope)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(article_id) DO UPDATE SET url = excluded.url,"
+                " price = excluded.price, favorites = excluded.favorites, fingerprint = excluded.fingerprint,"
+                " band = excluded.band, last_seen = excluded.last_seen, scope = excluded.scope",
+                upserts,
+            )
+            self.conn.executemany("INSERT INTO snapshots VALUES (?, ?, ?, ?)", snapshots)
+            self.conn.executemany("UPDATE latest SET last_seen = ?, scope = ? WHERE article_id = ?", touched)
+            if scope and items:
+                self.conn.execute(
+                    "INSERT INTO polls VALUES (?, ?, ?) ON CONFLICT(scope) DO UPDATE SET"
+                    " polled_at = excluded.polled_at, covered_since = excluded.covered_since",
+                    (scope, now, covered_since),
+                )
+            # 同じ一覧での値下げも反映してから、新しい記事と同じ指紋の記事を探す
+            batch_ids = {article_id(item["商品URL"]) for item in items}
+            for item, key, band, current_id in fresh:
+                relisted = self._relisted(key, band, now, batch_ids)
+                if relisted is not None:
+                    events.append(("relist", item, relisted))
+            self.conn.commit()
+        return events
+
+    def series(self, url):
+        """記事の(時刻, 価格, お気に入り数)の推移を返す"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT seen_at, price, favorites FROM snapshots WHERE article_id = ? ORDER BY seen_at",
+                (article_id(url),),
+            ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    # python -m jmty_snipe.history history.db https://jmty.jp/tokyo/sale-fur/article-xxxx
+    store = HistoryStore(sys.argv[1])
+    for seen_at, price, favorites in store.series(sys.argv[2]):
+        print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(seen_at))}  {price}円  お気に入り{favorites}")
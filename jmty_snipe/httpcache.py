@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+
+
+class HttpCache:
+    """URLごとのETag/Last-Modified/本文ハッシュを保存するディスクキャッシュ
+
+    新しい検証子は commit() されるまで保存しないため、処理に失敗したページは次回も再解析される。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.pending = {}
+        self.not_modified = 0  # 304が返ったリクエスト数
+        self.unchanged = 0  # 200だが本文が前回と同じだったリクエスト数
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as file:
+                    self.entries = json.load(file)
+            except Exception as e:
+                print(f"HTTPキャッシュの読み込み中にエラーが発生しました: {e}")
+
+    @property
+    def hits(self):
+        return self.not_modified + self.unchanged
+
+    def request_headers(self, url):
+        """条件付きリクエスト用のヘッダーを返す"""
+        entry = self.entries.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def check(self, url, response):
+        """レスポンスが前回から変わっていればTrueを返し、新しい検証子を保留する"""
+        with self._lock:
+            if response.status_code == 304:
+                self.not_modified += 1
+                return False
+            body_hash = hashlib.sha1(response.content).hexdigest()
+            if self.entries.get(url, {}).get("hash") == body_hash:
+                self.unchanged += 1
+                return False
+            self.misses += 1
+            self.pending[url] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "hash": body_hash,
+            }
+            return True
+
+    def check_stream(self, url, response):
+        """ストリームで読むレスポンス用のcheck()。本文を最後まで読まないためハッシュは比較しない"""
+        with self._lock:
+            if response.status_code == 304:
+                self.not_modified += 1
+                return False
+            self.misses += 1
+            self.pending[url] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "hash": None,
+            }
+            return True
+
+    def commit(self, url):
+        """処理が終わったページの検証子を確定する"""
+        with self._lock:
+            if url in self.pending:
+                self.entries[url] = self.pending.pop(url)
+
+    def discard(self, urls):
+        """URLの検証子を捨て、次回は本文を取得して解析し直す"""
+        with self._lock:
+            for url in urls:
+                self.entries.pop(url, None)
+                self.pending.pop(url, None)
+
+    def save(self):
+        """確定した検証子をファイルに書き出す"""
+        with self._lock:
+            with open(self.path, "w") as file:
+                json.dump(self.entries, file)
+
+    def stats(self):
+        return {"hits": self.hits, "not_modified": self.not_modified, "unchanged": self.unchanged, "misses": self.misses}
@@ -0,0 +1,136 @@
+import re
+from datetime import datetime, timedelta
+
+ARTICLE_ID = re.compile(r"article-([0-9a-zA-Z]+)")
+PRICE = re.compile(r"[0-9][0-9,]*")
+DATE = re.compile(r"(?:(\d{4})年)?(\d{1,2})月(\d{1,2})日")
+
+
+def article_id(url):
+    """商品URLから記事IDを取り出す。取り出せなければURLをそのまま返す"""
+    match = ARTICLE_ID.search(url)
+    return match.group(1) if match else url
+
+
+def parse_price(text):
+    """"4,000円"のような価格を整数にする。数字がなければNoneを返す"""
+    match = PRICE.search(text or "")
+    return int(match.group().replace(",", "")) if match else None
+
+
+def parse_posted_at(text, now=None):
+    """"1月2日"のような出品日を日時にする
+
+    一覧には年がないため、今年として未来の日付になる場合は去年の出品とみなす。
+    (1月に見つけた12月の出品が今年の12月にならないようにする)
+    """
+    match = DATE.search(text or "")
+    if not match:
+        return None
+    now = now or datetime.now()
+    year, month, day = match.groups()
+    try:
+        posted_at = datetime(int(year or now.year), int(month), int(day))
+        if not year and posted_at > now + timedelta(days=1):
+            posted_at = posted_at.replace(year=now.year - 1)
+    except ValueError:
+        return None
+    return posted_at
+
+
+def format_price(price):
+    return f"{price:,}円"
+
+
+def format_date(posted_at):
+    return f"{posted_at.month}月{posted_at.day}日"
+
+
+class Listing:
+    """一覧ページの商品1件。価格・お気に入り数は整数、出品日は日時で持つ
+
+    数値にできなかった元の文字列は*_textに残し、to_dict()で元の形式に戻せるようにする。
+    絞り込み(Rules、検索ごとの価格範囲)はこの記録に対して行い、商品ごとに価格を解析し直さない。
+    """
+
+    __slots__ = (
+        "title",
+        "price",
+        "posted_at",
+        "location",
+        "favorites",
+        "url",
+        "article_id",
+        "price_text",
+        "posted_text",
+        "favorites_text",
+    )
+
+    def __init__(
+        self, title, price, posted_at, location, favorites, url, price_text=None, posted_text=None, favorites_text=None
+    ):
+        self.title = title
+        self.price = price
+        self.posted_at = posted_at
+        self.location = location
+        self.favorites = favorites
+        self.url = url
+        self.article_id = article_id(url)
+        self.price_text = price_text
+        self.posted_text = posted_text
+        self.favorites_text = favorites_text
+
+    @classmethod
+    def from_dict(cls, item, now=None):
+        """scrape_itemsやprevious_data.jsonの辞書から作る"""
+        price = parse_price(item["価格"])
+        posted_at = parse_posted_at(item["出品日"], now)
+        favorites_text = item.get("お気に入り数", "0")
+        favorites = parse_price(favorites_text) or 0
+        return cls(
+            item["タイトル"],
+            price,
+            posted_at,
+            item["取引場所"],
+            favorites,
+            item["商品URL"],
+            # 整形し直すと元に戻らない場合だけ元の文字列を持つ
+            price_text=None if price is not None and format_price(price) == item["価格"] else item["価格"],
+            posted_text=None if posted_at and format_date(posted_at) == item["出品日"] else item["出品日"],
+            favorites_text=None if str(favorites) == favorites_text else favorites_text,
+        )
+
+    def to_dict(self):
+        """scrape_itemsと同じ形式の辞書に戻す"""
+        return {
+            "タイトル": self.title,
+            "価格": self.price_text if self.price_text is not None else format_price(self.price),
+            "出品日": self.posted_text if self.posted_text is not None else format_date(self.posted_at),
+            "取引場所": self.location,
+            "お気に入り数": self.favorites_text if self.favorites_text is not None else str(self.favorites),
+            "商品URL": self.url,
+        }
+
+    def __reduce__(self):
+        # プロセス間で受け渡すときは項目の値だけを送り、受け取った側で解析し直さない
+        return _restore_listing, tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Listing):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"Listing({self.article_id!r}, {self.title!r}, price={self.price!r}, posted_at={self.posted_at!r})"
+
+
+def _restore_listing(*values):
+    listing = Listing.__new__(Listing)
+    for name, value in zip(Listing.__slots__, values):
+        setattr(listing, name, value)
+    return listing
+
+
+def to_listings(items, now=None):
+    """辞書の商品のリストをListingのリストにする"""
+    return [Listing.from_dict(item, now) for item in items]
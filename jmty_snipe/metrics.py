@@ -0,0 +1,174 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 秒単位のヒストグラムの区切り
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 通知待ちの商品の初見時刻をこの件数まで覚えておく
+MAX_PENDING_SEEN = 10000
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels)
+
+
+class Metrics:
+    """ステージごとの所要時間と、初見から通知までの時間を集計する
+
+    Prometheusのテキスト形式とJSONで取り出せる。json_logsを有効にすると、
+    記録のたびにJSONの1行ログも出力する。
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.seen_at = OrderedDict()
+        self.json_logs = False
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_counter(self, name, value, **labels):
+        """別の場所で数えている累計値をそのまま反映する"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = value
+
+    def configure(self, json_logs=False, port=None):
+        """設定ファイルの"metrics"項目を反映し、portがあればエンドポイントを起動する"""
+        self.json_logs = json_logs
+        if port is not None:
+            return start_metrics_server(port)
+        return None
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """withブロックの所要時間をnameのヒストグラムに記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def log(self, event, **fields):
+        if self.json_logs:
+            print(json.dumps({"event": event, "time": time.time(), **fields}, ensure_ascii=False), flush=True)
+
+    def mark_seen(self, urls, seen_at):
+        """新着として見つけた商品の時刻を覚えておく"""
+        with self._lock:
+            for url in urls:
+                self.seen_at.setdefault(url, seen_at)
+            while len(self.seen_at) > MAX_PENDING_SEEN:
+                self.seen_at.popitem(last=False)
+
+    def observe_delivered(self, urls, channel):
+        """通知を送り終えた商品について、初見から通知までの時間を記録する"""
+        now = time.time()
+        latencies = [now - self.seen_at[url] for url in urls if url in self.seen_at]
+        for latency in latencies:
+            self.observe("jmty_time_to_notify_seconds", latency, channel=channel)
+        if latencies:
+            self.log("notified", channel=channel, count=len(latencies), max_latency=max(latencies))
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式で出力する"""
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (other, labels), value in self.counters.items():
+                    if other == name:
+                        lines.append(f"{name}{{{_labels(labels)}}} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (other, labels), histogram in self.histograms.items():
+                    if other != name:
+                        continue
+                    prefix = _labels(labels) + "," if labels else ""
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+                    lines.append(f"{name}_sum{{{_labels(labels)}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{_labels(labels)}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSONで返せる形の集計結果"""
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": dict(zip(map(str, histogram.buckets), histogram.counts)),
+                    }
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+
+# プロセス全体で共有する集計先
+metrics = Metrics()
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """/metrics(Prometheus形式)と/metrics.json(JSON)を返すHTTPサーバーを起動する"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # サーバーを使う場合のみ読み込む
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.render_prometheus().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    return httpd
@@ -0,0 +1,448 @@
+import functools
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .listing import parse_posted_at
+from .metrics import metrics
+
+LINE_NOTIFY_URL = "https://notify-api.line.me/api/notify"
+# 通知済みとして覚えておく(通知先, 見出し, 商品URL, 価格)の件数
+ROUTED_LIMIT = 10000
+# 詳細の通知に含める説明の文字数
+DESCRIPTION_LENGTH = 80
+
+
+def format_item(item):
+    """商品1件分の通知文を作る"""
+    # 年をまたいだ出品でも正しい年になるように出品日を解決する
+    posted_at = parse_posted_at(item["出品日"])
+    posted = f"{posted_at.year}年{item['出品日']}" if posted_at and "年" not in item["出品日"] else item["出品日"]
+    text = f"{item['タイトル']}\n価格: {item['価格']}\n出品日: {posted}\n場所: {item['取引場所']}\nURL: {item['商品URL']}"
+    if item.get("相場"):
+        text += f"\n相場: {item['相場']}"
+    if item.get("値下げ前"):
+        text += f"\n値下げ前: {item['値下げ前']}"
+    if item.get("前回の出品"):
+        text += f"\n再出品の可能性: {item['前回の出品']}"
+    # 記事ページの詳細を取得した商品は、追っての通知で詳細も送る
+    if item.get("エリア"):
+        text += f"\nエリア: {item['エリア']}"
+    if item.get("状態"):
+        text += f"\n状態: {item['状態']}"
+    if item.get("出品者"):
+        text += f"\n出品者: {item['出品者']}"
+    if item.get("説明"):
+        description = item["説明"]
+        text += f"\n説明: {description[:DESCRIPTION_LENGTH]}{'…' if len(description) > DESCRIPTION_LENGTH else ''}"
+    if item.get("画像"):
+        text += f"\n写真({len(item['画像'])}枚): {item['画像'][0]}"
+    return text
+
+
+def format_message(keyword, items, list_url=None, heading="新着情報"):
+    """まとめた商品の通知文を作る"""
+    footer = f"\n一覧: {list_url}" if list_url else ""
+    count = f"({len(items)}件)" if len(items) > 1 else ""
+    return f"\n{keyword}の{heading}{count}:\n" + "\n\n".join(format_item(item) for item in items) + footer
+
+
+def batch_items(items, max_batch=5, list_url=None, max_length=1000):
+    """商品をmax_batch件ずつ、通知文が文字数の上限を超えないように分ける"""
+    footer_length = len(f"\n一覧: {list_url}") if list_url else 0
+    batches = []
+    batch = []
+    length = 0
+    for item in items:
+        body_length = len(format_item(item)) + 2
+        if batch and (len(batch) >= max_batch or length + body_length + footer_length + 40 > max_length):
+            batches.append(batch)
+            batch = []
+            length = 0
+        batch.append(item)
+        length += body_length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class Notifier:
+    """通知先の基底クラス。send()で1通送り、レート制限で送れなければFalseを返す"""
+
+    # 1通に入れられる文字数
+    max_length = 1000
+
+    def __init__(self, session=None):
+        self.session = session or requests.Session()
+        self.blocked_until = 0.0
+
+    def wait_seconds(self):
+        """次に送れるまでの秒数"""
+        return max(0.0, self.blocked_until - time.time())
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def _post(self, url, **kwargs):
+        """POSTし、429ならRetry-Afterの秒数だけ送信を止めてFalseを返す"""
+        response = self.session.post(url, timeout=10, **kwargs)
+        if response.status_code == 429:
+            self.blocked_until = max(self.blocked_until, time.time() + float(response.headers.get("Retry-After", 60)))
+            return False
+        response.raise_for_status()
+        return True
+
+
+class LineNotifier(Notifier):
+    """LINE Notifyに送信し、レスポンスヘッダーのレート制限を覚えておく"""
+
+    def __init__(self, token, session=None, url=LINE_NOTIFY_URL):
+        super().__init__(session)
+        self.token = token
+        self.url = url
+
+    def send(self, message):
+        response = self.session.post(
+            self.url,
+            headers={"Authorization": "Bearer " + self.token},
+            params={"message": message},
+            timeout=10,
+        )
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if response.status_code == 429 or remaining == "0":
+            # 制限が解除される時刻(UNIX時間)まで待つ。ヘッダーがなければRetry-Afterか60秒
+            if reset:
+                self.blocked_until = float(reset)
+            else:
+                self.blocked_until = time.time() + float(response.headers.get("Retry-After", 60))
+        if response.status_code == 429:
+            return False
+        response.raise_for_status()
+        return True
+
+
+class SlackNotifier(Notifier):
+    """SlackのIncoming Webhookに送信する"""
+
+    max_length = 3000
+
+    def __init__(self, url, session=None):
+        super().__init__(session)
+        self.url = url
+
+    def send(self, message):
+        return self._post(self.url, json={"text": message.strip()})
+
+
+class DiscordNotifier(Notifier):
+    """DiscordのWebhookに送信する"""
+
+    max_length = 2000
+
+    def __init__(self, url, session=None):
+        super().__init__(session)
+        self.url = url
+
+    def send(self, message):
+        response = self.session.post(self.url, json={"content": message.strip()}, timeout=10)
+        # Discordは残り回数と解除までの秒数をヘッダーで返す
+        if response.status_code == 429 or response.headers.get("X-RateLimit-Remaining") == "0":
+            reset_after = response.headers.get("X-RateLimit-Reset-After") or response.headers.get("Retry-After", 1)
+            self.blocked_until = time.time() + float(reset_after)
+        if response.status_code == 429:
+            return False
+        response.raise_for_status()
+        return True
+
+
+class WebhookNotifier(Notifier):
+    """任意のURLに{"text": 通知文}をJSONでPOSTする"""
+
+    max_length = 10000
+
+    def __init__(self, url, headers=None, session=None):
+        super().__init__(session)
+        self.url = url
+        self.headers = headers or {}
+
+    def send(self, message):
+        return self._post(self.url, json={"text": message.strip()}, headers=self.headers)
+
+
+class EmailNotifier(Notifier):
+    """SMTPでメールを送る。件名は通知文の1行目"""
+
+    max_length = 20000
+
+    def __init__(self, host, sender, recipients, port=587, username=None, password=None, starttls=True):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients if isinstance(recipients, list) else [recipients]
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+
+    def send(self, message):
+        import smtplib  # メールで通知する場合のみ読み込む
+        from email.message import EmailMessage
+
+        body = message.strip()
+        mail = EmailMessage()
+        mail["Subject"] = body.splitlines()[0]
+        mail["From"] = self.sender
+        mail["To"] = ", ".join(self.recipients)
+        mail.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(mail)
+        return True
+
+
+class NotificationQueue:
+    """1つの通知先への通知をバックグラウンドのスレッドで送るキュー
+
+    スクレイピング側はput()で積むだけで待たない。溜まった通知は検索ごとにまとめて送り、
+    レート制限に達した場合は固定の間隔ではなく、通知先が示す解除時刻まで待つ。
+    再試行しても送れなかった商品と、送る前に諦めた商品はon_failed(見出し, 商品)に渡す。
+    """
+
+    def __init__(self, notifier, max_batch=5, max_attempts=3, name=None, on_failed=None):
+        self.notifier = notifier
+        self.name = name or type(notifier).__name__
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.on_failed = on_failed
+        self.queue = queue.Queue()
+        # 取り出し済みの通知も諦めるためのフラグ。abandon()の間だけ立てる
+        self._abandon = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="notify", daemon=True)
+        self._thread.start()
+
+    def put(self, keyword, items, list_url=None, heading="新着情報"):
+        self.queue.put((keyword, list(items), list_url, heading))
+
+    def _drain(self):
+        """キューに溜まっている通知を検索ごとにまとめて取り出す
+
+        (まとめた通知, 取り出した件数, 止める合図を受けたか)を返す。止める合図はclose()が積むNone。
+        """
+        entries = [self.queue.get()]
+        while entries[-1] is not None:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        grouped = {}
+        for keyword, items, list_url, heading in filter(None, entries):
+            grouped.setdefault((keyword, list_url, heading), []).extend(items)
+        return grouped, len(entries), entries[-1] is None
+
+    def _run(self):
+        stop = False
+        while not stop:
+            grouped, count, stop = self._drain()
+            try:
+                for (keyword, list_url, heading), items in grouped.items():
+                    for batch in batch_items(items, self.max_batch, list_url, self.notifier.max_length):
+                        if self._abandon.is_set():
+                            self._failed(heading, batch)
+                            continue
+                        with metrics.timer("jmty_notify_seconds", channel=self.name):
+                            delivered = self._deliver(format_message(keyword, batch, list_url, heading))
+                        # 詳細の通知は初見から通知までの時間に含めない
+                        if delivered and heading == "新着情報":
+                            metrics.observe_delivered([item["商品URL"] for item in batch], self.name)
+                        if not delivered:
+                            self._failed(heading, batch)
+            finally:
+                for _ in range(count):
+                    self.queue.task_done()
+
+    def _deliver(self, message):
+        """送信できればTrueを返す"""
+        for attempt in range(self.max_attempts):
+            wait = self.notifier.wait_seconds()
+            # 諦めるよう指示されたら、レート制限や再試行の待ちを切り上げる
+            if wait and self._abandon.wait(wait):
+                return False
+            try:
+                if self.notifier.send(message):
+                    return True
+            except Exception as e:
+                print(f"通知の送信中にエラーが発生しました({self.name}): {e}")
+                if self._abandon.wait(2**attempt):
+                    return False
+        print(f"通知を送れませんでした({self.name}): {message[:50]}")
+        metrics.increment("jmty_notify_failures_total", channel=self.name)
+        return False
+
+    def _failed(self, heading, items):
+        if self.on_failed is not None:
+            self.on_failed(heading, items)
+
+    def abandon(self):
+        """まだ送っていない通知を送らずに取り出し、送れなかった通知として扱う
+
+        スレッドが取り出し済みの通知は、送信中の1通を除いて残りを諦め、諦め終えるまで待つ。
+        """
+        # スレッドが取り出したばかりの通知も諦めるよう、キューが空になるまでフラグを立てたままにする
+        self._abandon.set()
+        stopped = False
+        try:
+            while True:
+                try:
+                    entry = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if entry is None:
+                        stopped = True
+                    else:
+                        self._failed(entry[3], entry[1])
+                finally:
+                    self.queue.task_done()
+            if stopped:
+                # 止める合図はスレッドに渡し直す
+                self.queue.put(None)
+            self.flush()
+        finally:
+            self._abandon.clear()
+
+    def flush(self, timeout=None):
+        """積まれた通知を送り終えるまで待つ。送り終えればTrueを返す"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """送り終えるのを待ってからスレッドを止める。待ちきれなかった通知は諦める"""
+        if not self.flush(timeout):
+            self.abandon()
+        # キューで待っているスレッドを起こして止める
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+
+class Dispatcher:
+    """検索ごとに指定された通知先へ、通知先ごとのキューを通して同時に送る
+
+    通知先ごとに別のスレッドとレート制限を持つため、通知先を増やしても待ち時間は増えない。
+    送れなかった新着の商品URLは状態ファイルごとに覚えておき、take_undelivered()で返す。
+    """
+
+    def __init__(self, channels, default=None, max_batch=5):
+        self.queues = {
+            name: NotificationQueue(
+                notifier, max_batch, name=name, on_failed=functools.partial(self._undelivered, name)
+            )
+            for name, notifier in channels.items()
+        }
+        self.default = default or list(channels)
+        # 複数の検索に該当した商品も、通知先ごとに1回だけ送る。値は積んだ検索の状態ファイル
+        self.routed = OrderedDict()
+        self.undelivered = {}
+        self._lock = threading.Lock()
+
+    def put(self, search, items, heading="新着情報"):
+        """検索の"channels"に書かれた通知先(なければ既定の通知先)に積む"""
+        for name in search.get("channels", self.default):
+            if name not in self.queues:
+                print(f"[{search['name']}] 通知先{name}は設定されていません")
+                continue
+            with self._lock:
+                # 値下げは価格ごとに通知するため、価格もキーに含める
+                fresh = [item for item in items if (name, heading, item["商品URL"], item["価格"]) not in self.routed]
+                if not fresh:
+                    continue
+                # キーワードのない検索もあるため、その場合は検索名を見出しにする
+                self.queues[name].put(search.get("keyword") or search["name"], fresh, search.get("list_url"), heading)
+                # 積めなかった商品は次のティックで積み直せるよう、積めてから通知済みにする
+                for item in fresh:
+                    self.routed[(name, heading, item["商品URL"], item["価格"])] = search.get("state")
+                while len(self.routed) > ROUTED_LIMIT:
+                    self.routed.popitem(last=False)
+
+    def _undelivered(self, name, heading, items):
+        """送れなかった商品を、次に積まれたときに送り直せるようにする"""
+        with self._lock:
+            for item in items:
+                state = self.routed.pop((name, heading, item["商品URL"], item["価格"]), None)
+                # 詳細や値下げの通知は状態に関係しないため、新着のみ状態から外す
+                if heading == "新着情報" and state is not None:
+                    self.undelivered.setdefault(state, set()).add(item["商品URL"])
+
+    def take_undelivered(self, filenames=None):
+        """送れなかった新着の商品URLを{状態ファイル: URLの集合}で返し、忘れる
+
+        filenamesを渡すと、その状態ファイルの分のみ返す。
+        """
+        with self._lock:
+            taken = {
+                filename: urls
+                for filename, urls in self.undelivered.items()
+                if filenames is None or filename in filenames
+            }
+            for filename in taken:
+                del self.undelivered[filename]
+        return taken
+
+    def abandon(self):
+        """まだ送っていない通知を諦め、送れなかった通知として扱う"""
+        for notification_queue in self.queues.values():
+            notification_queue.abandon()
+
+    def flush(self, timeout=None):
+        """全ての通知先を並行して送り終えるまで待つ"""
+        if not self.queues:
+            return True
+        with ThreadPoolExecutor(max_workers=len(self.queues)) as executor:
+            return all(executor.map(lambda q: q.flush(timeout), self.queues.values()))
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        for notification_queue in self.queues.values():
+            notification_queue.close(0)
+
+
+NOTIFIERS = {
+    "line": LineNotifier,
+    "slack": SlackNotifier,
+    "discord": DiscordNotifier,
+    "webhook": WebhookNotifier,
+    "email": EmailNotifier,
+}
+
+
+def create_notifier(options):
+    """設定から通知先を作る。"_env"で終わる項目は環境変数の値に置き換える"""
+    options = dict(options)
+    kind = options.pop("type")
+    for key in [key for key in options if key.endswith("_env")]:
+        options[key[: -len("_env")]] = os.environ.get(options.pop(key))
+    return NOTIFIERS[kind](**options)
+
+
+def create_dispatcher(config):
+    """設定ファイルの"channels"項目から通知の振り分け先を作る
+
+    "channels"がなければ、従来どおり環境変数LINE_TOKENのLINE Notifyに送る。
+    """
+    channels_config = config.get("channels") or {"line": {"type": "line", "token_env": "LINE_TOKEN"}}
+    channels = {name: create_notifier(options) for name, options in channels_config.items()}
+    return Dispatcher(channels, config.get("default_channels"), **config.get("notify", {}))
@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .listing import to_listings
+from .parsers import get_parser
+
+_parse = None
+
+
+def _init_worker(parser):
+    """ワーカーの起動時に解析関数を1回だけ選ぶ"""
+    global _parse
+    _parse = get_parser(parser)
+
+
+def _parse_listings(content):
+    """一覧ページを解析し、価格や出品日も数値にしたListingのリストを返す(ワーカー側で実行する)"""
+    return to_listings(_parse(content))
+
+
+def _ready(delay):
+    # 先に起動したワーカーが全ての呼び出しを受けないよう、少し待ってから返す
+    time.sleep(delay)
+    return os.getpid()
+
+
+class ParserPool:
+    """一覧ページの解析を別プロセスのワーカーで並列に行う
+
+    ワーカーはティックをまたいで起動したままにし、HTMLのバイト列を渡して商品のListingを受け取る。
+    解析木はワーカーの中だけで作り、価格や出品日の解析もワーカーで済ませる。
+    parse_items(content)と同じく1ページを解析する関数としても呼べる。
+    """
+
+    def __init__(self, parser="html.parser", max_workers=None, chunksize=1):
+        self.parser = parser
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        # スレッドを持つ親プロセスをforkしないよう、forkserver(なければspawn)で起動する
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self.executor = ProcessPoolExecutor(
+            self.max_workers, mp_context=context, initializer=_init_worker, initargs=(parser,)
+        )
+
+    def warm_up(self):
+        """全てのワーカーを起動しておき、最初のティックで起動を待たないようにする"""
+        start = time.perf_counter()
+        pids = set(self.executor.map(_ready, [0.05] * self.max_workers))
+        return len(pids), time.perf_counter() - start
+
+    def parse_many(self, pages):
+        """複数の一覧ページを並列に解析し、ページごとのListingのリストを同じ順序で返す"""
+        return list(self.executor.map(_parse_listings, pages, chunksize=self.chunksize))
+
+    def __call__(self, content):
+        return [listing.to_dict() for listing in self.parse_many([content])[0]]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def parse_pages(parse_items, pages):
+    """ページごとのListingのリストを返す。ParserPoolならまとめてワーカーに渡す"""
+    parse_many = getattr(parse_items, "parse_many", None)
+    if parse_many is not None:
+        return parse_many(pages)
+    return [to_listings(parse_items(page)) for page in pages]
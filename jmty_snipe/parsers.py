@@ -0,0 +1,150 @@
+from .scraper import parse_page, scrape_items
+
+# bs4のget_text()と同じく、これらのタグの中身は文字列に含めない
+SKIPPED_TEXT_TAGS = ("script", "style", "template")
+
+
+def parse_items_bs4(content):
+    """BeautifulSoup(html.parser)で商品情報を取り出す"""
+    return scrape_items(parse_page(content))
+
+
+def _element_text(element):
+    """要素以下の文字列をbs4のget_text()と同じ規則で連結する"""
+    parts = []
+
+    def walk(node):
+        if node.text and node.tag not in SKIPPED_TEXT_TAGS:
+            parts.append(node.text)
+        for child in node:
+            # コメントなどのタグ以外のノードは本文に含めず、後ろの文字列のみ拾う
+            if isinstance(child.tag, str) and child.tag not in SKIPPED_TEXT_TAGS:
+                walk(child)
+            if child.tail:
+                parts.append(child.tail)
+
+    walk(element)
+    return "".join(parts)
+
+
+def _extract_item(item):
+    """li要素を1回だけ走査し、必要な要素の最初の出現を拾う"""
+    title_element = price_element = location_element = date_element = favorite_element = None
+    for element in item.iterdescendants():
+        if not isinstance(element.tag, str):
+            continue
+        class_attr = element.get("class")
+        if not class_attr:
+            continue
+        classes = class_attr.split()
+        if element.tag == "div":
+            if title_element is None and "p-item-title" in classes:
+                title_element = element
+            if price_element is None and "p-item-most-important" in classes:
+                price_element = element
+            if location_element is None and "p-item-secondary-important" in classes:
+                location_element = element
+            if date_element is None and "u-color-gray" in classes:
+                date_element = element
+        elif element.tag == "span" and favorite_element is None and " ".join(classes) == "u-size-s js_fav_user_count":
+            favorite_element = element
+
+    title = _element_text(title_element).strip()
+    price = _element_text(price_element).strip()
+    location = _element_text(location_element).strip() if location_element is not None else "不明"
+    date_text = _element_text(date_element).strip() if date_element is not None else "不明"
+    date = date_text.replace("作成", "").strip()  # "作成"という単語を取り除く
+    favorite = _element_text(favorite_element).strip() if favorite_element is not None else "0"
+    link = next(title_element.iterdescendants("a"))
+    return {
+        "タイトル": title,
+        "価格": price,
+        "出品日": date,
+        "取引場所": location,
+        "お気に入り数": favorite,
+        "商品URL": link.get("href"),
+    }
+
+
+def parse_items_lxml(content):
+    """lxmlで必要な項目だけを取り出す高速版(出力はparse_items_bs4と同一)"""
+    from lxml import html  # lxmlを使う場合のみ必要
+
+    if isinstance(content, bytes):
+        document = html.document_fromstring(content, parser=html.HTMLParser(encoding="utf-8"))
+    else:
+        document = html.document_fromstring(content)
+    items = []
+    for item in document.iter("li"):
+        if "p-articles-list-item" in (item.get("class") or "").split():
+            items.append(_extract_item(item))
+    return items
+
+
+def iter_items_stream(chunks):
+    """HTMLを少しずつ読み込みながら、商品情報を1件ずつ返す
+
+    読み終えたli要素は都度削除するため、ページ全体の木は作らない。
+    """
+    from lxml import etree  # lxmlを使う場合のみ必要
+
+    parser = etree.HTMLPullParser(events=("end",), tag="li", encoding="utf-8")
+
+    def read_items():
+        for _, element in parser.read_events():
+            if "p-articles-list-item" not in (element.get("class") or "").split():
+                continue
+            yield _extract_item(element)
+            # 処理済みの要素を捨ててメモリを抑える
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from read_items()
+    parser.close()
+    yield from read_items()
+
+
+def scan_until_known(items, is_known, stop_after=3, accept=None):
+    """新着順の商品を、既知の商品がstop_after件続くところまで読み進める
+
+    上部に固定表示される古い商品があっても止まらないよう、連続した件数で判定する。
+    acceptに合わない商品は保存されず既知にならないため、連続の判定では読み飛ばす。
+    読み終えた商品(既知のものも含む)のリストを返す。
+    """
+    scanned = []
+    known_run = 0
+    for item in items:
+        scanned.append(item)
+        if accept is not None and not accept(item):
+            continue
+        known_run = known_run + 1 if is_known(item) else 0
+        if known_run >= stop_after:
+            break
+    return scanned
+
+
+PARSERS = {
+    "html.parser": parse_items_bs4,
+    "lxml": parse_items_lxml,
+}
+
+
+def has_lxml():
+    """lxmlが使えるか確認する"""
+    try:
+        import lxml.html  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_parser(name="html.parser"):
+    """名前から一覧ページの解析関数を返す。lxmlがなければhtml.parserを使う"""
+    if name == "lxml" and not has_lxml():
+        print("lxmlがインストールされていないため、html.parserで解析します")
+        return parse_items_bs4
+    return PARSERS[name]
+
@@ -0,0 +1,114 @@
+import re
+
+from .rules import get_rules, normalize
+
+
+def fetch_key(search):
+    """同じ一覧ページを取得する検索が同じ値になるキー(価格範囲は含めない)"""
+    return (search.get("location", "all"), search["category"], search.get("genre") or "", search.get("keyword", ""))
+
+
+def price_range(search):
+    """検索の価格範囲を(最小, 最大)で返す。上限なしはNone"""
+    maximum = str(search.get("max", "")).strip()
+    return int(search.get("min") or 0), int(maximum) if maximum else None
+
+
+def keyword_terms(keyword):
+    """"panasonic+toshiba"のようなキーワードを正規化した語のリストにする"""
+    return [normalize(term) for term in re.split(r"[+\s]+", keyword) if term]
+
+
+def subscriber_filter(search, fetch_range, title_terms=None):
+    """まとめた取得結果から、その検索に該当する商品(Listing)を選ぶ関数を作る。全て該当するならNone"""
+    checks = []
+    low, high = price_range(search)
+    if (low, high) != fetch_range:
+
+        def in_range(listing):
+            price = listing.price
+            return price is not None and price >= low and (high is None or price <= high)
+
+        checks.append(in_range)
+    if title_terms:
+        # ジモティーのキーワード検索は本文も対象のため、タイトルだけで判定すると取りこぼすことがある
+        checks.append(lambda listing: all(term in normalize(listing.title) for term in title_terms))
+    rules = get_rules(search)
+    if rules is not None:
+        checks.append(rules)
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+    return lambda listing: all(check(listing) for check in checks)
+
+
+def merged_range(searches):
+    ranges = [price_range(search) for search in searches]
+    highs = [high for _, high in ranges]
+    return min(low for low, _ in ranges), None if None in highs else max(highs)
+
+
+def plan(searches, merge_keywords=False):
+    """重なる検索をまとめ、取得する一覧ページをできるだけ少なくする
+
+    地域・カテゴリー・ジャンル・キーワードが同じ検索は、価格範囲を合わせた1つの取得にまとめ、
+    検索ごとの価格範囲と"rules"は取得後に絞り込む。merge_keywordsを指定すると、
+    キーワード付きの検索もキーワードなしの同じ条件の検索にまとめ、タイトルで絞り込む。
+    取得ごとに、検索と同じ形の辞書に"subscribers"(元の検索)と"filters"(検索ごとの絞り込み)、
+    "accept"(いずれかの検索に該当すればTrueを返す関数)、"priority"(1ページ目の取得の優先度)を付けて返す。
+    """
+    groups = {}
+    for search in searches:
+        groups.setdefault(fetch_key(search), []).append(search)
+    title_terms = {}
+    if merge_keywords:
+        for key in list(groups):
+            location, category, genre, keyword = key
+            broad = (location, category, genre, "")
+            if keyword and broad in groups:
+                for search in groups.pop(key):
+                    title_terms[id(search)] = keyword_terms(keyword)
+                    groups[broad].append(search)
+    fetches = []
+    for (location, category, genre, keyword), subscribers in groups.items():
+        low, high = merged_range(subscribers)
+        filters = [subscriber_filter(search, (low, high), title_terms.get(id(search))) for search in subscribers]
+        fetch = {
+            "name": "+".join(search["name"] for search in subscribers),
+            "location": location,
+            "category": category,
+            "genre": genre,
+            "keyword": keyword,
+            "min": str(low),
+            "max": "" if high is None else str(high),
+            "max_pages": max(search.get("max_pages", 1) for search in subscribers),
+            # まとめた検索のどれかが重要なら、取得も優先する
+            "priority": "high" if any(search.get("priority") == "high" for search in subscribers) else "poll",
+            "subscribers": subscribers,
+            "filters": filters,
+            "accept": None,
+        }
+        if all(accept is not None for accept in filters):
+            fetch["accept"] = lambda listing, filters=filters: any(accept(listing) for accept in filters)
+        fetches.append(fetch)
+    return fetches
+
+
+def group_searches(searches, merge_keywords=False, by_state=False):
+    """同じティックで実行する検索ごとのリストを返す
+
+    同じ取得にまとめられる検索は同じティックで実行する。by_stateを指定すると、状態ファイル(seen_index)を
+    共有する検索も同じティックにまとめる。別々のティックで動かすと、先のティックが保存した商品は
+    後のティックで既知になり、後の検索(とその通知先)には届かないため。
+    """
+    groups = [fetch["subscribers"] for fetch in plan(searches, merge_keywords)]
+    if not by_state:
+        return groups
+    merged = []
+    for group in groups:
+        states = {search["state"] for search in group}
+        joined = [other for other in merged if states & {search["state"] for search in other}]
+        merged = [other for other in merged if not any(other is target for target in joined)]
+        merged.append([search for other in joined for search in other] + group)
+    return merged
@@ -0,0 +1,85 @@
+import heapq
+import itertools
+import threading
+import time
+
+from .metrics import metrics
+
+# 数字が小さいほど先に送る。重要な検索の1ページ目 > 通常の1ページ目 > 2ページ目以降 > 記事ページ
+PRIORITIES = {"high": 0, "poll": 1, "backfill": 2, "enrich": 3}
+# 速度を落とす応答のステータスコード
+SLOW_DOWN_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RequestScheduler:
+    """全てのリクエストが通るトークンバケット
+
+    1秒あたりrate件まで(一時的にburst件まで)送り、待っているリクエストは優先度の順に通す。
+    429/5xxを受けると速度をbackoff倍に落とし、成功が続くとrateまで少しずつ戻す。
+    """
+
+    def __init__(self, rate=2.0, burst=5, min_rate=0.1, backoff=0.5, recovery=0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.backoff = backoff
+        self.recovery = recovery
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority="poll"):
+        """送ってよくなるまで待ち、待った秒数を返す"""
+        entry = (PRIORITIES[priority], next(self._sequence))
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._waiting[0] == entry and now >= self.paused_until and self.tokens >= 1:
+                    heapq.heappop(self._waiting)
+                    self.tokens -= 1
+                    # 次に優先度の高いリクエストが確認できるよう起こす
+                    self._condition.notify_all()
+                    break
+                if self._waiting[0] != entry:
+                    timeout = None
+                elif now < self.paused_until:
+                    timeout = self.paused_until - now
+                else:
+                    timeout = (1 - self.tokens) / self.rate
+                self._condition.wait(timeout)
+        waited = time.monotonic() - start
+        metrics.observe("jmty_request_wait_seconds", waited, priority=priority)
+        return waited
+
+    def slow_down(self, retry_after=None):
+        """429/5xxを受けたときに速度を落とす。Retry-Afterがあればその間は送らない"""
+        with self._condition:
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        metrics.increment("jmty_request_slowdowns_total")
+        print(f"リクエストの速度を落とします: {self.rate:.2f}件/秒")
+
+    def speed_up(self):
+        """成功した応答ごとに、上限まで少しずつ速度を戻す"""
+        with self._condition:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery)
+
+    def feedback(self, response):
+        """応答のステータスから速度を調整する"""
+        if response.status_code in SLOW_DOWN_STATUSES:
+            retry_after = response.headers.get("Retry-After")
+            self.slow_down(float(retry_after) if retry_after and retry_after.isdigit() else None)
+        else:
+            self.speed_up()
@@ -0,0 +1,93 @@
+import json
+import re
+import sys
+import unicodedata
+
+from .listing import to_listings
+
+# 同じ条件は1プロセスで1回だけコンパイルする
+_compiled = {}
+
+
+def normalize(text):
+    """全角・半角や大文字・小文字の違いを吸収する"""
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def compile_patterns(patterns):
+    """正規表現のリストを1つの正規表現にまとめる"""
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{normalize(pattern)})" for pattern in patterns))
+
+
+def price_bands(price):
+    """[最小, 最大]または[[最小, 最大], ...]を範囲のリストにする。nullは上限・下限なし"""
+    if not price:
+        return []
+    if not isinstance(price[0], (list, tuple)):
+        price = [price]
+    return [(low if low is not None else 0, high if high is not None else float("inf")) for low, high in price]
+
+
+class Rules:
+    """検索ごとの絞り込み条件。商品(Listing)が条件に合えばTrueを返す
+
+    include/excludeはタイトルに対する正規表現、priceは価格帯、locationsは取引場所に
+    含まれていればよい地名、min_favoritesはお気に入り数の下限。
+    """
+
+    def __init__(self, include=None, exclude=None, price=None, locations=None, min_favorites=0):
+        self.include = compile_patterns(include)
+        self.exclude = compile_patterns(exclude)
+        self.price_bands = price_bands(price)
+        self.locations = [normalize(location) for location in locations or []]
+        self.min_favorites = min_favorites
+
+    def __call__(self, listing):
+        if self.include or self.exclude:
+            title = normalize(listing.title)
+            if self.include and not self.include.search(title):
+                return False
+            if self.exclude and self.exclude.search(title):
+                return False
+        if self.price_bands:
+            # 価格が読み取れない商品は範囲外として扱う
+            price = listing.price
+            if price is None or not any(low <= price <= high for low, high in self.price_bands):
+                return False
+        if self.locations:
+            location = normalize(listing.location)
+            if not any(allowed in location for allowed in self.locations):
+                return False
+        if self.min_favorites and listing.favorites < self.min_favorites:
+            return False
+        return True
+
+
+def get_rules(search):
+    """検索の"rules"項目からコンパイル済みの条件を返す。条件がなければNoneを返す"""
+    rules = search.get("rules")
+    if not rules:
+        return None
+    key = json.dumps(rules, sort_keys=True, ensure_ascii=False)
+    if key not in _compiled:
+        _compiled[key] = Rules(**rules)
+    return _compiled[key]
+
+
+if __name__ == "__main__":
+    # python -m jmty_snipe.rules searches.json fixtures/typical.html
+    from .engine import load_searches
+    from .parsers import parse_items_bs4
+
+    with open(sys.argv[2], "rb") as file:
+        items = parse_items_bs4(file.read())
+    for search in load_searches(sys.argv[1]):
+        accept = get_rules(search) or (lambda listing: True)
+        accepted = [item for item, listing in zip(items, to_listings(items)) if accept(listing)]
+        print(f"[{search['name']}] {len(items)}件中{len(accepted)}件が条件に合います")
+        for item in accepted:
+            print(f"  {item['価格']:>10} {item['タイトル']}")
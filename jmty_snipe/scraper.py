@@ -0,0 +1,61 @@
+import os
+from urllib.parse import quote
+
+# ローカルのスタンドインサーバーで確認する場合は環境変数で差し替える
+BASE_URL = os.environ.get("JMTY_BASE_URL", "https://jmty.jp")
+
+
+def build_url(search, page=1, base_url=None):
+    """検索条件から一覧ページのURLを組み立てる"""
+    encoded_keyword = quote(search.get("keyword", ""))
+    path = f"{base_url or BASE_URL}/{search.get('location', 'all')}/sale-{search['category']}"
+    # ジャンル指定がなければカテゴリー全体を検索する
+    if search.get("genre"):
+        path += f"/g-{search['genre']}"
+    if page > 1:
+        path += f"/p-{page}"
+    return f"{path}?min={search.get('min', '0')}&max={search.get('max', '')}&keyword={encoded_keyword}"
+
+
+def parse_page(content):
+    """取得したHTMLを解析する"""
+    from bs4 import BeautifulSoup  # lxmlで解析する場合は読み込まない
+
+    return BeautifulSoup(content, "html.parser")
+
+
+def fetch_data(url, fetcher=None):
+    """指定されたURLからデータを取得し、解析する"""
+    if fetcher is None:
+        from urllib.request import urlopen
+
+        return parse_page(urlopen(url, timeout=30))
+    return parse_page(fetcher.get(url).content)
+
+
+def scrape_items(bs):
+    """商品情報をスクレイピングする"""
+    items = []
+    item_box = bs.findAll("li", {"class": "p-articles-list-item"})
+    for item in item_box:
+        title = item.find("div", {"class": "p-item-title"}).get_text().strip()
+        price = item.find("div", {"class": "p-item-most-important"}).get_text().strip()
+        location_element = item.find("div", {"class": "p-item-secondary-important"})
+        location = location_element.get_text().strip() if location_element else "不明"
+        date_element = item.find("div", {"class": "u-color-gray"})
+        date_text = date_element.get_text().strip() if date_element else "不明"
+        date = date_text.replace("作成", "").strip()  # "作成"という単語を取り除く
+        favorite_element = item.find("span", {"class": "u-size-s js_fav_user_count"})
+        favorite = favorite_element.get_text().strip() if favorite_element else "0"
+        product_url = item.find("div", {"class": "p-item-title"}).find("a").get("href")
+        items.append(
+            {
+                "タイトル": title,
+                "価格": price,
+                "出品日": date,
+                "取引場所": location,
+                "お気に入り数": favorite,
+                "商品URL": product_url,
+            }
+        )
+    return items
@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+
+SHEET_COLUMNS = ["タイトル", "価格", "出品日", "取引場所", "お気に入り数", "商品URL"]
+# 以前はpandasのインデックス列を先頭に書き出していたため、列の位置を合わせる
+HEADER = [""] + SHEET_COLUMNS
+# 書き込み済みとして覚えておく商品URLの件数
+WRITTEN_LIMIT = 10000
+
+
+class SheetSink:
+    """新着商品をスプレッドシートの見出しの直下に挿入する出力先
+
+    シート全体を読み書きせず、新しい行だけを1回のAPI呼び出しで送る。
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.has_header = None
+        # 複数の検索に該当した商品も1行だけ書き込む
+        self.written = OrderedDict()
+        self._lock = threading.Lock()
+
+    def write(self, items):
+        if not items:
+            return
+        # 複数の検索から同時に呼ばれても行の挿入が混ざらないようにする
+        with self._lock:
+            self._write(items)
+
+    def _write(self, items):
+        if self.has_header is None:
+            self.has_header = bool(self.worksheet.row_values(1))
+        if not self.has_header:
+            self.worksheet.insert_rows([HEADER], row=1)
+            self.has_header = True
+        items = [item for item in items if item.get("商品URL") not in self.written]
+        if not items:
+            return
+        # 新しい商品が上に来るように見出しの直下へ挿入する
+        rows = [[""] + [item.get(column, "") for column in SHEET_COLUMNS] for item in items]
+        self.worksheet.insert_rows(rows, row=2, value_input_option="RAW")
+        for item in items:
+            self.written[item.get("商品URL")] = True
+        while len(self.written) > WRITTEN_LIMIT:
+            self.written.popitem(last=False)
+
+
+class FakeWorksheet:
+    """テストやオフライン確認用に、gspreadのワークシートの代わりをするメモリ上の表"""
+
+    def __init__(self, rows=None):
+        self.rows = [list(row) for row in rows or []]
+        self.calls = 0
+
+    def row_values(self, row):
+        self.calls += 1
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def insert_rows(self, values, row=1, value_input_option="RAW"):
+        self.calls += 1
+        self.rows[row - 1 : row - 1] = [list(value) for value in values]
+
+
+def open_worksheet(credentials_file, spreadsheet_key):
+    """サービスアカウントでスプレッドシートの最初のシートを開く"""
+    from gspread import service_account  # スプレッドシートを使う場合のみ必要
+
+    return service_account(filename=credentials_file).open_by_key(spreadsheet_key).sheet1
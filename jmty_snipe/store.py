@@ -0,0 +1,178 @@
+import glob
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+BLOOM_SUFFIX = ".bloom"
+
+# 長時間動かす場合も接続を開き直さないよう、ファイルごとのストアを使い回す
+_stores = {}
+
+
+class SeenStore:
+    """既知の商品をSQLiteに保存するストア
+
+    previous_dataの辞書と同じく `url in store` と `store[url] = item` で使える。
+    追加した商品はcommit()までメモリに溜め、新しい商品の分だけ書き込む。
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.pending = {}
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY, item TEXT NOT NULL, first_seen REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS seen_first_seen ON seen (first_seen)")
+        self.conn.commit()
+
+    def __contains__(self, url):
+        if url in self.pending:
+            return True
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM seen WHERE url = ?", (url,)).fetchone() is not None
+
+    def __setitem__(self, url, item):
+        self.pending[url] = item
+
+    def __getitem__(self, url):
+        if url in self.pending:
+            return self.pending[url]
+        with self._lock:
+            row = self.conn.execute("SELECT item FROM seen WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            raise KeyError(url)
+        return json.loads(row[0])
+
+    def __bool__(self):
+        if self.pending:
+            return True
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM seen LIMIT 1").fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0] + len(self.pending)
+
+    def commit(self):
+        """溜めた商品をまとめて書き込む"""
+        if not self.pending:
+            return
+        now = time.time()
+        rows = [(url, json.dumps(item, ensure_ascii=False), now) for url, item in self.pending.items()]
+        with self._lock:
+            self.conn.executemany("INSERT OR IGNORE INTO seen (url, item, first_seen) VALUES (?, ?, ?)", rows)
+            self.conn.commit()
+        self.pending = {}
+
+    def claim(self, items):
+        """まだ誰も保存していない商品のみ保存し、その商品を返す
+
+        複数のプロセスが同じファイルを共有していても、同じ商品を取れるのは1つだけになる。
+        """
+        now = time.time()
+        claimed = []
+        with self._lock:
+            for item in items:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO seen (url, item, first_seen) VALUES (?, ?, ?)",
+                    (item["商品URL"], json.dumps(item, ensure_ascii=False), now),
+                )
+                if cursor.rowcount:
+                    claimed.append(item)
+            self.conn.commit()
+        return claimed
+
+    def unclaim(self, urls):
+        """claim()した商品を、通知できなかった場合に戻す"""
+        with self._lock:
+            self.conn.executemany("DELETE FROM seen WHERE url = ?", [(url,) for url in urls])
+            self.conn.commit()
+
+    def forget(self, urls):
+        """通知できなかった商品を外し、次のティックで新着として扱う"""
+        for url in urls:
+            self.pending.pop(url, None)
+        self.unclaim(urls)
+
+    def compact(self, ttl_days):
+        """ttl_daysより前に見つけた商品を削除し、削除件数を返す"""
+        with self._lock:
+            cursor = self.conn.execute("DELETE FROM seen WHERE first_seen < ?", (time.time() - ttl_days * 86400,))
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+        return cursor.rowcount
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def is_sqlite(filename):
+    return filename.endswith(SQLITE_SUFFIXES)
+
+
+def load_state(filename):
+    """状態ファイルを開く。拡張子が.dbならSeenStore、.bloomならFingerprintState、それ以外はJSONの辞書を返す"""
+    if filename.endswith(BLOOM_SUFFIX):
+        if filename not in _stores:
+            from .fingerprint import FingerprintState
+
+            _stores[filename] = FingerprintState(filename)
+        return _stores[filename]
+    if is_sqlite(filename):
+        if filename not in _stores:
+            _stores[filename] = SeenStore(filename)
+        return _stores[filename]
+    if filename not in _stores:
+        data = {}
+        if os.path.exists(filename):
+            with open(filename, "r") as file:
+                data = json.load(file)
+        # 同じファイルを使う検索が同じ辞書を共有するよう、読み込みは1回だけにする
+        _stores[filename] = data
+    return _stores[filename]
+
+
+def save_state(filename, data):
+    """状態を保存する。SeenStoreなどは新しい商品のみ書き込む"""
+    if hasattr(data, "commit"):
+        data.commit()
+        return
+    with open(filename, "w") as file:
+        json.dump(data, file, ensure_ascii=False)
+
+
+def migrate(filename, json_files):
+    """previous_data*.jsonの商品を状態ファイル(.db/.bloom)に取り込み、取り込んだ件数を返す"""
+    store = load_state(filename)
+    count = 0
+    for json_file in json_files:
+        with open(json_file, "r") as file:
+            for url, item in json.load(file).items():
+                if url not in store:
+                    store[url] = item
+                    count += 1
+    save_state(filename, store)
+    return count
+
+
+if __name__ == "__main__":
+    # python -m jmty_snipe.store migrate seen.db previous_data*.json (seen.bloomも可)
+    # python -m jmty_snipe.store compact seen.db 180
+    command, filename, *args = sys.argv[1:]
+    if command == "migrate":
+        json_files = [path for pattern in args for path in glob.glob(pattern)]
+        print(f"{migrate(filename, json_files)}件を{filename}に取り込みました")
+    elif command == "compact":
+        store = SeenStore(filename)
+        print(f"{store.compact(float(args[0]) if args else 180)}件を削除しました")
+        store.close()
+    else:
+        sys.exit(f"不明なコマンドです: {command}")
@@ -0,0 +1,88 @@
+import asyncio
+import random
+import signal
+import time
+
+
+class Watcher:
+    """検索ごとの間隔で監視を続けるasyncioのデーモン
+
+    検索ごとに1つのタスクが動き、前のティックが終わるまで次のティックは始めないため、
+    同じ検索のティックが重なることはない。別の検索のティックはスレッドで並行して動く。
+    新着が見つかった検索は間隔を縮め、新着のない検索は間隔を伸ばす。
+    groupsを渡すと、そのリスト(planner.group_searches)ごとに検索を1つのティックで実行する。
+    """
+
+    def __init__(self, searches, run_tick, interval=60, min_interval=15, max_interval=600, jitter=0.1, groups=None):
+        self.searches = searches
+        self.groups = groups or [[search] for search in searches]
+        self.run_tick = run_tick
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.intervals = {}
+        self._stop = None
+
+    def next_interval(self, search, new_count):
+        """新着の件数から、その検索(またはまとめた検索のリスト)の次の間隔を決める"""
+        group = search if isinstance(search, list) else [search]
+        name = "+".join(search["name"] for search in group)
+        # まとめた検索は、最も短い間隔を求める検索に合わせる
+        current = self.intervals.get(name, min(search.get("interval", self.interval) for search in group))
+        minimum = min(search.get("min_interval", self.min_interval) for search in group)
+        maximum = min(search.get("max_interval", self.max_interval) for search in group)
+        if new_count is None:
+            pass  # 他のワーカーが担当している間は間隔を変えない
+        elif new_count:
+            current = max(minimum, current / 2)
+        else:
+            current = min(maximum, current * 1.25)
+        self.intervals[name] = current
+        return current
+
+    async def _watch(self, group, offset):
+        # 全ての検索が同時に始まらないよう、最初の実行をずらす
+        if await self._sleep(offset):
+            return
+        while not self._stop.is_set():
+            start = time.monotonic()
+            try:
+                results = await asyncio.to_thread(self.run_tick, group)
+                new_count = None if results is None else sum(result["new"] for result in results)
+            except Exception as e:
+                print(f"[{'+'.join(search['name'] for search in group)}] 監視中にエラーが発生しました: {e}")
+                new_count = 0
+            interval = self.next_interval(group, new_count)
+            delay = interval * random.uniform(1 - self.jitter, 1 + self.jitter) - (time.monotonic() - start)
+            if await self._sleep(max(0.0, delay)):
+                return
+
+    async def _sleep(self, seconds):
+        """停止するまで最大seconds秒待つ。停止した場合はTrueを返す"""
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run(self):
+        """SIGINT/SIGTERMを受け取るまで監視を続け、実行中のティックが終わってから戻る"""
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windowsやメインスレッド以外では使えない
+        count = len(self.groups)
+        tasks = [
+            asyncio.create_task(self._watch(group, self.interval * index / count * self.jitter))
+            for index, group in enumerate(self.groups)
+        ]
+        await asyncio.gather(*tasks)
+        print("監視を停止しました")
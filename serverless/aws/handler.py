@@ -0,0 +1,56 @@
+import functools
+import json
+import os
+
+from jmty_snipe.app import App
+
+SEARCHES_FILE = os.path.join(os.path.dirname(__file__), "searches.json")
+
+# 実行環境が再利用される間はコネクションプールと解析関数も使い回す
+# CloudWatch Logsで集計できるよう、ステージごとの所要時間をJSONの1行ログで出す
+app = App(SEARCHES_FILE, json_logs=True)
+# boto3はコールドスタートを遅くしないよう、最初に使うときに読み込む
+s3_client = None
+
+
+def get_s3_client():
+    global s3_client
+    if s3_client is None:
+        import boto3
+
+        s3_client = boto3.client("s3")
+    return s3_client
+
+
+def load_previous_data(bucket_name, filename):
+    """S3から以前のデータを読み込む。まだなければ空の辞書を返す"""
+    s3 = get_s3_client()
+    try:
+        body = s3.get_object(Bucket=bucket_name, Key=filename)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return {}
+    return json.loads(body)
+
+
+def save_previous_data(bucket_name, filename, data):
+    """S3にデータを保存する"""
+    body = json.dumps(data, ensure_ascii=False).encode()
+    get_s3_client().put_object(Bucket=bucket_name, Key=filename, Body=body, ContentType="application/json")
+
+
+def handler(event, context):
+    bucket_name = os.environ.get("BUCKET_NAME")  # 環境変数からバケット名を取得
+    if not bucket_name:
+        print("バケット名が環境変数に設定されていません")
+        return {"searches": 0}
+
+    # スクレイピング設定はsearches.jsonに記述し、全ての検索を1回の起動で実行する
+    results = app.run(
+        load_state=functools.partial(load_previous_data, bucket_name),
+        save_state=functools.partial(save_previous_data, bucket_name),
+        # 関数が止まった後に送れなかった商品を既知にしないよう、状態を保存する前に新着の通知を送り終える
+        flush_timeout=app.config.get("notify_timeout", 60),
+    )
+    # 関数が終わる前に詳細の取得と通知を送り終える
+    app.flush(timeout=app.config.get("notify_timeout", 60))
+    return {"searches": len(results), "new": sum(result["new"] for result in results)}
@@ -0,0 +1,24 @@
+import os
+import shutil
+
+import pytest
+
+from jmty_snipe import scraper
+from jmty_snipe.fakeserver import FixtureServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fixtures")
+
+
+def fixture_path(name):
+    return os.path.join(FIXTURES, name)
+
+
+@pytest.fixture
+def fixture_server(tmp_path, monkeypatch):
+    """fixtures/typical.htmlを全ての一覧ページとして返すサーバーに、build_url()の接続先を向ける"""
+    directory = tmp_path / "pages"
+    directory.mkdir()
+    shutil.copy(fixture_path("typical.html"), directory / "default.html")
+    with FixtureServer(str(directory)) as server:
+        monkeypatch.setattr(scraper, "BASE_URL", server.url)
+        yield server
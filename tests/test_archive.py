@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from jmty_snipe import archive
+from jmty_snipe.archive import GONE_AFTER, ListingArchive, read_partition, write_partition
+
+DAY = 86400
+NOW = 1_700_000_000
+
+
+def item(article, price, location="東京都 世田谷区"):
+    return {
+        "タイトル": f"テーブル {article}",
+        "価格": price,
+        "取引場所": location,
+        "お気に入り数": "1",
+        "商品URL": f"https://jmty.jp/tokyo/sale-fur/article-{article}",
+    }
+
+
+def fill(directory):
+    store = ListingArchive(str(directory))
+    sofa = {"name": "ソファ", "category": "sale", "keyword": "ソファ"}
+    desk = {"name": "机", "category": "sale", "keyword": "机"}
+    # 取り下げられた記事と、価格を下げて掲載中の記事を何日かに分けて書く
+    for day in range(5):
+        when = NOW - (4 - day) * DAY
+        store.append(sofa, [item(f"s{index}", f"{1000 * (index + day % 2)}円") for index in range(day, day + 6)], when)
+        store.append(sofa, [item(f"o{day}", "3,000円", "大阪府 大阪市")], when)
+        store.append(sofa, [item(f"u{day}", "500円", "不明")], when)
+        store.append(desk, [item(f"d{index}", "価格未定" if index == 2 else f"{700 * index}円") for index in range(4)], when)
+    return store
+
+
+def test_numpy_grouping_matches_row_loop(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    store = fill(tmp_path)
+    grouped = store.aggregate(NOW)
+    monkeypatch.setattr(archive, "load_numpy", lambda: None)
+    looped = store.aggregate(NOW)
+    assert grouped.prices.keys() == looped.prices.keys()
+    for key, stats in looped.prices.items():
+        assert grouped.prices[key] == pytest.approx(stats)
+    assert grouped.durations == pytest.approx(looped.durations)
+    assert ("sale//ソファ", "大阪府") in looped.prices
+    assert looped.durations["sale//ソファ"][0] > 0
+
+
+def test_unknown_region_is_counted_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "load_numpy", lambda: None)
+    store = ListingArchive(str(tmp_path))
+    search = {"name": "ソファ", "category": "sale", "keyword": "ソファ"}
+    store.append(search, [item("a", "1,000円", "不明"), item("b", "3,000円")], NOW)
+    prices = store.aggregate(NOW + GONE_AFTER).prices
+    assert prices[("sale//ソファ", "")] == (2, 1500, 2000, 2500)
+    assert prices[("sale//ソファ", "東京都")] == (1, 3000, 3000, 3000)
+
+
+def test_interrupted_write_is_cut_back_before_next_append(tmp_path):
+    path = str(tmp_path / "part")
+    write_partition(path, "market", [(NOW, 1000, 0, "https://a", "a", "東京都")])
+    # priceまで書いたところで止まり、seen_atの値も途中までしか書けなかった場合
+    with open(os.path.join(path, "seen_at.bin"), "ab") as f:
+        f.write(b"\0" * 12)
+    with open(os.path.join(path, "price.bin"), "ab") as f:
+        f.write(b"\0" * 8)
+    with open(os.path.join(path, "url.txt"), "ab") as f:
+        f.write("https://b\nhttps://".encode())
+    assert len(read_partition(path)["url"]) == 1
+
+    write_partition(path, "market", [(NOW + 1, 2000, 3, "https://c", "c", "大阪府")])
+    columns = read_partition(path)
+    assert list(columns["seen_at"]) == [NOW, NOW + 1]
+    assert list(columns["price"]) == [1000, 2000]
+    assert list(columns["favorites"]) == [0, 3]
+    assert columns["url"] == ["https://a", "https://c"]
+    assert columns["region"] == ["東京都", "大阪府"]
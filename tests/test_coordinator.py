@@ -0,0 +1,79 @@
+import json
+import time
+
+import pytest
+
+from jmty_snipe.coordinator import Coordinator, SqliteLeaseBackend, create_coordinator, rendezvous_owner
+from jmty_snipe.engine import load_config
+
+TTL = 0.6
+
+
+def shard_owned_by(worker, workers):
+    return next(f"shard{n}" for n in range(100) if rendezvous_owner(f"shard{n}", workers) == worker)
+
+
+def test_lease_moves_to_the_other_worker_after_ttl(tmp_path):
+    path = str(tmp_path / "leases.db")
+    first = Coordinator(SqliteLeaseBackend(path), worker="a", ttl=TTL)
+    second = Coordinator(SqliteLeaseBackend(path), worker="b", ttl=TTL)
+    try:
+        first.heartbeat()
+        shard = shard_owned_by("a", ["a", "b"])
+        assert first.owns(shard)
+        assert not second.owns(shard)
+        # aが止まる(ハートビートもリースの延長もしない)
+        first._stop.set()
+        # bが他の担当と思っていても、aのリースが切れるまでは取れない
+        assert not second.backend.acquire(shard, "b", TTL)
+        deadline = time.time() + 5 * TTL
+        while not second.owns(shard) and time.time() < deadline:
+            time.sleep(TTL / 6)
+        assert second.owns(shard)
+        assert second.workers == ["b"]
+    finally:
+        first._stop.set()
+        second.close()
+
+
+def test_leaving_worker_hands_over_at_once(tmp_path):
+    path = str(tmp_path / "leases.db")
+    first = Coordinator(SqliteLeaseBackend(path), worker="a", ttl=30)
+    second = Coordinator(SqliteLeaseBackend(path), worker="b", ttl=30)
+    try:
+        first.heartbeat()
+        shard = shard_owned_by("a", ["a", "b"])
+        assert first.owns(shard)
+        first.close()
+        second.heartbeat()
+        assert second.owns(shard)
+    finally:
+        second.close()
+
+
+def write_config(tmp_path, **config):
+    filename = tmp_path / "searches.json"
+    filename.write_text(json.dumps({"searches": [{"name": "机", "category": "fur"}], **config}))
+    return str(filename)
+
+
+@pytest.mark.parametrize("state", [{}, {"seen_index": "seen.bloom"}, {"seen_index": "gcs.json"}])
+def test_shard_needs_a_shared_sqlite_state(tmp_path, state):
+    with pytest.raises(ValueError):
+        load_config(write_config(tmp_path, shard={"path": str(tmp_path / "leases.db")}, **state))
+
+
+def test_create_coordinator_checks_states(tmp_path):
+    with pytest.raises(ValueError):
+        create_coordinator(
+            {"shard": {"path": str(tmp_path / "leases.db")}, "searches": [{"name": "机", "state": "a.json"}]}
+        )
+
+
+def test_shard_with_seen_index(tmp_path):
+    config = load_config(write_config(tmp_path, shard={"path": str(tmp_path / "leases.db")}, seen_index="seen.db"))
+    coordinator = create_coordinator(config)
+    try:
+        assert coordinator.owns("机")
+    finally:
+        coordinator.close()
@@ -0,0 +1,57 @@
+import pytest
+
+from jmty_snipe.engine import run_searches
+from jmty_snipe.fetcher import Fetcher
+from jmty_snipe.listing import parse_price
+from jmty_snipe.parsers import parse_items_lxml
+from jmty_snipe.store import load_state
+
+
+def test_undelivered_items_are_fetched_again_despite_http_cache(fixture_server, tmp_path):
+    state = str(tmp_path / "state.json")
+    searches = [{"name": "家具", "category": "fur", "state": state}]
+    fetcher = Fetcher(cache=str(tmp_path / "http_cache.json"))
+    notified = []
+    failed = {}
+
+    def undelivered(filenames):
+        return {filename: failed.pop(filename) for filename in list(failed) if filename in filenames}
+
+    def run():
+        run_searches(searches, lambda search, items: notified.append(items), fetcher=fetcher, undelivered=undelivered)
+
+    try:
+        run()
+        assert len(notified[0]) == 50
+        # 通知先に届かなかったことが、ティックの後に分かった場合
+        failed[state] = {item["商品URL"] for item in notified[0]}
+        run()
+        assert len(notified) == 2 and len(notified[1]) == 50
+        assert len(load_state(state)) == 50
+        # 届いた後は、検証子を使って取得を省く
+        run()
+        assert len(notified) == 2
+        assert fetcher.cache.not_modified == 1
+    finally:
+        fetcher.close()
+
+
+@pytest.mark.parametrize("early_exit", [0, 3])
+def test_merged_fetch_filters_each_search_by_its_price_range(fixture_server, tmp_path, early_exit):
+    state = str(tmp_path / "state.json")
+    searches = [
+        {"name": "安い", "category": "fur", "min": "0", "max": "1000", "state": state},
+        {"name": "高い", "category": "fur", "min": "1001", "max": "", "state": state},
+    ]
+    notified = {}
+    results = run_searches(
+        searches,
+        lambda search, items: notified.setdefault(search["name"], []).extend(items),
+        parse_items=parse_items_lxml,
+        early_exit=early_exit,
+    )
+    assert len(fixture_server.requests) == 1
+    prices = {name: [parse_price(item["価格"]) for item in items] for name, items in notified.items()}
+    assert prices["安い"] and all(price <= 1000 for price in prices["安い"])
+    assert prices["高い"] and all(price > 1000 for price in prices["高い"])
+    assert sum(result["new"] for result in results) == 50
@@ -0,0 +1,60 @@
+import pytest
+import requests
+
+from jmty_snipe.fetcher import Fetcher
+from jmty_snipe.ratelimit import RequestScheduler
+
+
+@pytest.fixture
+def fetcher(tmp_path):
+    fetcher = Fetcher(max_workers=4, backoff=0.01, cache=str(tmp_path / "http_cache.json"))
+    yield fetcher
+    fetcher.close()
+
+
+def test_fetch_all_keeps_order_and_reports_errors(fixture_server, fetcher):
+    with open(fixture_server.directory + "/default.html", "rb") as file:
+        body = file.read()
+    fixture_server.errors["/missing"] = [404]
+    urls = [f"{fixture_server.url}/page{number}" for number in range(3)] + [f"{fixture_server.url}/missing"]
+    results = fetcher.fetch_all(urls)
+    assert [page for page, _, _ in results[:3]] == [body] * 3
+    page, _, error = results[3]
+    assert page is None and isinstance(error, requests.HTTPError)
+
+
+def test_unchanged_page_is_skipped_after_commit(fixture_server, fetcher):
+    url = fixture_server.url + "/page"
+    assert fetcher.get_if_modified(url) is not None
+    # 処理を確定するまでは、次の取得でも本文を返す
+    assert fetcher.get_if_modified(url) is not None
+    fetcher.commit(url)
+    assert fetcher.get_if_modified(url) is None
+    assert fetcher.cache.not_modified == 1
+    fetcher.discard([url])
+    assert fetcher.get_if_modified(url) is not None
+
+
+def test_server_errors_are_retried(fixture_server, fetcher):
+    fixture_server.errors["/page"] = [503, 500]
+    assert fetcher.get(fixture_server.url + "/page").status_code == 200
+    assert fixture_server.requests == ["/page"] * 3
+
+
+def test_retries_give_up(fixture_server, fetcher):
+    fixture_server.errors["/page"] = [503] * 4
+    with pytest.raises(requests.HTTPError):
+        fetcher.get(fixture_server.url + "/page")
+    assert len(fixture_server.requests) == fetcher.retries + 1
+
+
+def test_every_retry_takes_a_token(fixture_server, monkeypatch):
+    fetcher = Fetcher(backoff=0.01, rate=100, burst=5)
+    acquired = []
+    monkeypatch.setattr(RequestScheduler, "acquire", lambda self, priority="poll": acquired.append(priority))
+    fixture_server.errors["/page"] = [429, 503]
+    try:
+        fetcher.get(fixture_server.url + "/page", priority="high")
+    finally:
+        fetcher.close()
+    assert acquired == ["high"] * 3
@@ -0,0 +1,47 @@
+from jmty_snipe.archive import GONE_AFTER
+from jmty_snipe.history import HistoryStore
+
+
+def item(article, title="ダイニングテーブル", price="5,000円"):
+    return {
+        "タイトル": title,
+        "価格": price,
+        "出品日": "1月2日",
+        "取引場所": "東京都 世田谷区",
+        "お気に入り数": "0",
+        "商品URL": f"https://jmty.jp/tokyo/sale-fur/article-{article}",
+    }
+
+
+def kinds(events):
+    return [(kind, found["商品URL"][-1]) for kind, found, _ in events]
+
+
+def test_listing_missing_from_one_batch_is_not_a_relist(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    assert history.observe([item("a")], 100, scope="家具") == []
+    # 別の検索(または取得しなかったページ)で似た商品を見ても、aはまだ掲載中かもしれない
+    assert history.observe([item("b")], 200, scope="机") == []
+    assert history.observe([item("c")], 250, scope="家具") == []
+    assert history.observe([item("a")], 300, scope="家具") == []
+
+
+def test_relist_after_own_search_no_longer_shows_it(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    history.observe([item("old", "椅子", "500円")], 50, scope="家具")
+    history.observe([item("a"), item("old", "椅子", "500円")], 100, scope="家具")
+    # aより古い記事まで見直したのにaがない
+    assert kinds(history.observe([item("b"), item("old", "椅子", "500円")], 200, scope="家具")) == [("relist", "b")]
+
+
+def test_relist_after_gone_threshold(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    history.observe([item("a")], 100, scope="家具")
+    assert kinds(history.observe([item("b")], 100 + GONE_AFTER + 1, scope="机")) == [("relist", "b")]
+
+
+def test_price_drop(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    history.observe([item("a")], 100, scope="家具")
+    events = history.observe([item("a", price="4,000円")], 200, scope="家具")
+    assert [(kind, previous["price"]) for kind, _, previous in events] == [("price_drop", 5000)]
@@ -0,0 +1,61 @@
+import pickle
+from datetime import datetime
+
+import pytest
+
+from jmty_snipe.listing import Listing, parse_posted_at, to_listings
+from jmty_snipe.parsers import parse_items_bs4
+from jmty_snipe.planner import subscriber_filter
+from jmty_snipe.rules import Rules
+
+from .conftest import fixture_path
+
+
+@pytest.mark.parametrize("name", ["small", "typical", "large"])
+def test_round_trip_keeps_the_scraped_dicts(name):
+    with open(fixture_path(f"{name}.html"), "rb") as file:
+        items = parse_items_bs4(file.read())
+    listings = to_listings(items)
+    assert [listing.to_dict() for listing in listings] == items
+    assert pickle.loads(pickle.dumps(listings)) == listings
+
+
+def test_numeric_fields():
+    listing = Listing.from_dict(
+        {
+            "タイトル": "机",
+            "価格": "4,000円",
+            "出品日": "12月30日",
+            "取引場所": "東京都 世田谷区",
+            "お気に入り数": "12",
+            "商品URL": "https://jmty.jp/tokyo/sale-fur/article-1abc2",
+        },
+        now=datetime(2026, 1, 5),
+    )
+    assert (listing.price, listing.favorites, listing.article_id) == (4000, 12, "1abc2")
+    # 1月に見つけた12月の出品は去年の出品
+    assert listing.posted_at == datetime(2025, 12, 30)
+    assert listing.price_text is listing.posted_text is listing.favorites_text is None
+
+
+def test_unparsed_text_is_kept():
+    item = {"タイトル": "机", "価格": "要相談", "出品日": "不明", "取引場所": "不明", "お気に入り数": "", "商品URL": "x"}
+    listing = Listing.from_dict(item)
+    assert listing.price is None and listing.posted_at is None and listing.favorites == 0
+    assert listing.to_dict() == item
+
+
+def test_parse_posted_at_rejects_invalid_dates():
+    assert parse_posted_at("2月30日") is None
+
+
+def test_filters_compare_numbers():
+    listings = to_listings(
+        {"タイトル": title, "価格": price, "出品日": "1月2日", "取引場所": "東京都", "お気に入り数": favorites, "商品URL": title}
+        for title, price, favorites in (("a", "500円", "0"), ("b", "1,500円", "3"), ("c", "要相談", "9"))
+    )
+    in_range = subscriber_filter({"min": "1000", "max": "2000"}, (0, None))
+    assert [listing.title for listing in listings if in_range(listing)] == ["b"]
+    rules = Rules(price=[None, 1000])
+    assert [listing.title for listing in listings if rules(listing)] == ["a"]
+    assert [listing.title for listing in listings if Rules(min_favorites=3)(listing)] == ["b", "c"]
@@ -0,0 +1,131 @@
+import email
+import email.policy
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from jmty_snipe.fakeserver import SmtpReceiver, WebhookReceiver
+from jmty_snipe.notify import (
+    DiscordNotifier,
+    EmailNotifier,
+    LineNotifier,
+    NotificationQueue,
+    Notifier,
+    SlackNotifier,
+    WebhookNotifier,
+)
+
+MESSAGE = "\n机の新着情報:\nダイニングテーブル\n価格: 5,000円"
+
+
+@pytest.fixture
+def receiver():
+    with WebhookReceiver() as receiver:
+        yield receiver
+
+
+def test_line(receiver):
+    assert LineNotifier("token", url=receiver.url + "/api/notify").send(MESSAGE)
+    request = receiver.received[0]
+    assert request["headers"]["Authorization"] == "Bearer token"
+    assert parse_qs(urlsplit(request["path"]).query)["message"] == [MESSAGE]
+
+
+@pytest.mark.parametrize(
+    "notifier, key", [(SlackNotifier, "text"), (DiscordNotifier, "content"), (WebhookNotifier, "text")]
+)
+def test_json_webhooks(receiver, notifier, key):
+    assert notifier(receiver.url + "/hook").send(MESSAGE)
+    assert json.loads(receiver.received[0]["body"]) == {key: MESSAGE.strip()}
+
+
+def test_email():
+    with SmtpReceiver() as smtp:
+        # SmtpReceiverはSTARTTLSに対応していない
+        notifier = EmailNotifier("127.0.0.1", "from@example.com", "to@example.com", port=smtp.port, starttls=False)
+        assert notifier.send(MESSAGE)
+    mail = email.message_from_string(smtp.messages[0], policy=email.policy.default)
+    assert mail["Subject"] == "机の新着情報:"
+    assert mail["To"] == "to@example.com"
+    assert "価格: 5,000円" in smtp.messages[0]
+
+
+@pytest.mark.parametrize("notifier", [SlackNotifier, DiscordNotifier, WebhookNotifier])
+def test_rate_limit_sets_retry_after(notifier):
+    with WebhookReceiver(rate_limit=1) as receiver:
+        channel = notifier(receiver.url)
+        assert channel.send(MESSAGE)
+        assert not channel.send(MESSAGE)
+        assert 0 < channel.wait_seconds() <= 1
+
+
+def test_line_rate_limit_sets_retry_after():
+    with WebhookReceiver(rate_limit=1) as receiver:
+        channel = LineNotifier("token", url=receiver.url)
+        assert channel.send(MESSAGE)
+        assert not channel.send(MESSAGE)
+        assert 0 < channel.wait_seconds() <= 1
+
+
+def test_queue_waits_for_retry_after_and_delivers():
+    with WebhookReceiver(rate_limit=1) as receiver:
+        failed = []
+        queue = NotificationQueue(WebhookNotifier(receiver.url), on_failed=lambda heading, items: failed.extend(items))
+        items = [{"タイトル": "机", "価格": "1円", "出品日": "1月2日", "取引場所": "東京都", "商品URL": f"u{n}"} for n in range(2)]
+        start = time.time()
+        queue.put("机", items[:1])
+        assert queue.flush(5)
+        queue.put("椅子", items[1:])
+        assert queue.flush(5)
+        queue.close(1)
+    assert len(receiver.received) == 2 and not failed
+    # 2通目は429になり、Retry-Afterの1秒を待って送り直す
+    assert time.time() - start >= 0.9
+
+
+class BlockingNotifier(Notifier):
+    """1通目の送信をreleaseが立つまで止める通知先"""
+
+    def __init__(self):
+        super().__init__()
+        self.sending = threading.Event()
+        self.release = threading.Event()
+        self.sent = []
+
+    def send(self, message):
+        self.sending.set()
+        self.release.wait(5)
+        self.sent.append(message)
+        return True
+
+
+def test_close_wakes_idle_worker():
+    queue = NotificationQueue(BlockingNotifier())
+    queue.close(1)
+    assert not queue._thread.is_alive()
+
+
+def test_abandon_gives_up_items_the_worker_already_took():
+    notifier = BlockingNotifier()
+    failed = []
+    queue = NotificationQueue(notifier, max_batch=1, on_failed=lambda heading, items: failed.extend(items))
+    items = [{"タイトル": "机", "価格": "1円", "出品日": "1月2日", "取引場所": "東京都", "商品URL": f"u{n}"} for n in range(3)]
+    queue.put("机", items)
+    assert notifier.sending.wait(5)
+    # スレッドは3件とも取り出し済みで、キューは空になっている
+    abandoning = threading.Thread(target=queue.abandon)
+    abandoning.start()
+    time.sleep(0.1)
+    notifier.release.set()
+    abandoning.join(5)
+    assert len(notifier.sent) == 1
+    assert [item["商品URL"] for item in failed] == ["u1", "u2"]
+    # 諦め終えたら、次に積んだ通知は送る
+    queue.put("机", items[:1])
+    assert queue.flush(5)
+    assert len(notifier.sent) == 2
+    queue.close(1)
+    assert not queue._thread.is_alive()
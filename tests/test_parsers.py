@@ -0,0 +1,38 @@
+import glob
+import os
+
+import pytest
+
+from jmty_snipe.parsers import iter_items_stream, parse_items_bs4, parse_items_lxml, scan_until_known
+
+from .conftest import FIXTURES
+
+PAGES = sorted(glob.glob(os.path.join(FIXTURES, "*.html")))
+
+
+def read(filename):
+    with open(filename, "rb") as file:
+        return file.read()
+
+
+@pytest.mark.parametrize("filename", PAGES, ids=os.path.basename)
+def test_lxml_matches_bs4(filename):
+    content = read(filename)
+    assert parse_items_lxml(content) == parse_items_bs4(content)
+
+
+@pytest.mark.parametrize("chunk_size", [512, 16 * 1024])
+@pytest.mark.parametrize("filename", PAGES, ids=os.path.basename)
+def test_stream_matches_bs4(filename, chunk_size):
+    content = read(filename)
+    chunks = (content[start : start + chunk_size] for start in range(0, len(content), chunk_size))
+    assert list(iter_items_stream(chunks)) == parse_items_bs4(content)
+
+
+def test_scan_stops_after_a_run_of_known_items():
+    items = parse_items_bs4(read(os.path.join(FIXTURES, "typical.html")))
+    known = {item["商品URL"] for item in items[10:]}
+    # 先頭に既知の商品が1件あっても、連続していなければ止まらない
+    known.add(items[0]["商品URL"])
+    scanned = scan_until_known(iter(items), lambda item: item["商品URL"] in known, stop_after=3)
+    assert scanned == items[:13]
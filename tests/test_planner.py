@@ -0,0 +1,25 @@
+from jmty_snipe.engine import run_searches
+from jmty_snipe.planner import group_searches
+
+
+def searches(state_a, state_b):
+    return [
+        {"name": "家具", "category": "fur", "state": state_a, "channels": ["h1"]},
+        {"name": "机", "category": "fur", "genre": "1255", "state": state_b, "channels": ["h2"]},
+    ]
+
+
+def test_searches_sharing_a_seen_index_tick_together():
+    shared = searches("seen.db", "seen.db")
+    assert [len(group) for group in group_searches(shared)] == [1, 1]
+    assert [len(group) for group in group_searches(shared, by_state=True)] == [2]
+    separate = searches("a.json", "b.json")
+    assert [len(group) for group in group_searches(separate, by_state=True)] == [1, 1]
+
+
+def test_shared_seen_index_reaches_every_matching_search(fixture_server, tmp_path):
+    shared = searches(str(tmp_path / "seen.db"), str(tmp_path / "seen.db"))
+    notified = {}
+    for group in group_searches(shared, by_state=True):
+        run_searches(group, lambda search, items: notified.setdefault(search["name"], []).extend(items))
+    assert {name: len(items) for name, items in notified.items()} == {"家具": 50, "机": 50}
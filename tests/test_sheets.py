@@ -0,0 +1,35 @@
+from jmty_snipe.sheets import HEADER, FakeWorksheet, SheetSink
+
+
+def item(number):
+    return {
+        "タイトル": f"机{number}",
+        "価格": "1,000円",
+        "出品日": "1月2日",
+        "取引場所": "東京都",
+        "お気に入り数": "0",
+        "商品URL": f"u{number}",
+    }
+
+
+def test_new_rows_go_under_the_header_in_one_call():
+    worksheet = FakeWorksheet()
+    sink = SheetSink(worksheet)
+    sink.write([item(1), item(2)])
+    # 見出しの確認と書き込み、新しい行の挿入
+    assert worksheet.calls == 3
+    sink.write([item(3)])
+    assert worksheet.calls == 4
+    assert worksheet.rows[0] == HEADER
+    assert [row[-1] for row in worksheet.rows[1:]] == ["u3", "u1", "u2"]
+
+
+def test_existing_header_and_written_items_are_kept():
+    worksheet = FakeWorksheet([HEADER, [""] + list(item(0).values())])
+    sink = SheetSink(worksheet)
+    sink.write([item(1)])
+    # 別の検索から同じ商品が来ても書き込まない
+    sink.write([item(1)])
+    sink.write([])
+    assert worksheet.calls == 2
+    assert [row[-1] for row in worksheet.rows[1:]] == ["u1", "u0"]